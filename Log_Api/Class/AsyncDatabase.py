@@ -0,0 +1,111 @@
+import os
+import asyncio
+import threading
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+from .Database import (Database, POOL_SIZE, POOL_MAX_OVERFLOW, POOL_RECYCLE,
+                       POOL_TIMEOUT, CONNECT_TIMEOUT)
+from ..Utils import Aws
+
+# Async MySQL driver: aiomysql or asyncmy
+ASYNC_DRIVER = os.getenv('DB_ASYNC_DRIVER', 'aiomysql')
+
+
+class AsyncDatabase():
+    """
+    Async counterpart of `Database`, with one `create_async_engine` engine per
+    (mode, APP, STAGE, event loop) shared by the container and `AsyncSession`
+    sessions. Pooled connections belong to the loop that opened them, so
+    each loop gets its own engine and the engines of closed loops are dropped.
+    It must be used from a coroutine.
+
+    session = AsyncDatabase('dbr').session
+    async with session:
+        result = await session.execute(select(LogAPI))
+    """
+    _engines = {}
+    _lock = threading.Lock()
+
+    # Mode can be:
+    # dbr: Mode Read
+    # dbw: Mode Write
+    def __init__(self, mode):
+        if mode is None or (mode != "dbw" and mode != "dbr"):
+            raise Warning("El modo de uso de base de datos no es válido.")
+
+        try:
+            entry = self.__get(mode)
+            self.engine = entry['engine']
+            # Create a new session
+            self.session = entry['session_maker']()
+        except Exception as e:
+            print(f'Error en conexion Base de datos: {e}')
+            raise Exception('Error en conexion Base de datos')
+
+    @classmethod
+    def __get(cls, mode):
+        loop = asyncio.get_running_loop()
+        key = (mode, os.getenv("APP", ""), os.getenv("STAGE", ""), loop)
+        entry = cls._engines.get(key)
+        if entry is not None:
+            return entry
+
+        with cls._lock:
+            entry = cls._engines.get(key)
+            if entry is None:
+                # Connections of a closed loop cannot be closed or reused
+                for closed in [k for k in cls._engines if k[3].is_closed()]:
+                    cls._engines.pop(closed)
+                # The secret is cached, only the first engine of the container waits for it
+                connection_data = Aws(f'{mode}{os.getenv("APP", "")}').get_secret()
+                connection_strings = Database.get_connection_strings(connection_data).replace(
+                    'mysql+pymysql://', f'mysql+{ASYNC_DRIVER}://', 1)
+                engine = create_async_engine(
+                    connection_strings,
+                    pool_size=POOL_SIZE,
+                    max_overflow=POOL_MAX_OVERFLOW,
+                    pool_recycle=POOL_RECYCLE,
+                    pool_timeout=POOL_TIMEOUT,
+                    pool_pre_ping=True,
+                    connect_args={'connect_timeout': CONNECT_TIMEOUT}
+                )
+                # Objects keep their values after commit, async sessions
+                # cannot lazy load expired attributes
+                entry = {
+                    'engine': engine,
+                    'session_maker': sessionmaker(
+                        bind=engine, class_=AsyncSession, expire_on_commit=False)
+                }
+                cls._engines[key] = entry
+        return entry
+
+    @classmethod
+    async def dispose(cls, mode=None):
+        """
+        Close the pooled connections of the async engines. The engines of
+        other loops are dropped without closing their connections
+        :param mode:
+            dbr or dbw, if None all the engines are disposed
+        """
+        loop = asyncio.get_running_loop()
+        with cls._lock:
+            keys = [key for key in cls._engines if mode is None or key[0] == mode]
+            entries = [(key[3], cls._engines.pop(key)) for key in keys]
+        for engine_loop, entry in entries:
+            if engine_loop is loop:
+                await entry['engine'].dispose()
+
+    @classmethod
+    async def handle_auth_failure(cls, mode, exception):
+        """
+        Async counterpart of `Database.handle_auth_failure`: on a rejected
+        password it also disposes the async engines of the mode, whose URL
+        has the old password
+        :return:
+            True if the exception was an authentication failure
+        """
+        if not Database.handle_auth_failure(mode, exception):
+            return False
+        await cls.dispose(mode)
+        return True
@@ -0,0 +1,141 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker():
+    """
+    Circuit breaker over the last `window` calls. It opens when the rate of
+    failed or slow calls reaches its threshold, rejects calls for
+    `open_seconds` and then lets `half_open_calls` trial calls decide if it
+    closes again.
+    """
+
+    def __init__(self, failure_rate=0.5, slow_call_ms=1000, slow_call_rate=0.5,
+                 window=20, min_calls=5, open_seconds=30, half_open_calls=1):
+        """
+        :param failure_rate:
+            Fraction of failed calls that opens the circuit
+        :param slow_call_ms:
+            Calls slower than this are counted as slow
+        :param slow_call_rate:
+            Fraction of slow calls that opens the circuit
+        :param window:
+            Number of recent calls evaluated
+        :param min_calls:
+            Calls needed in the window before the circuit can open
+        :param open_seconds:
+            Seconds the circuit stays open before the trial calls
+        :param half_open_calls:
+            Trial calls allowed while half open
+        """
+        self.failure_rate = failure_rate
+        self.slow_call_ms = slow_call_ms
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.__calls = deque(maxlen=window)
+        self.__state = CLOSED
+        self.__opened_at = 0
+        self.__trials = 0
+        self.__lock = threading.Lock()
+        self.__stats = {'rejected': 0, 'opened': 0}
+
+    @property
+    def state(self):
+        with self.__lock:
+            return self.__current_state()
+
+    def allow(self):
+        """
+        True if a call can be made now
+        """
+        with self.__lock:
+            state = self.__current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self.__trials < self.half_open_calls:
+                self.__trials += 1
+                return True
+            self.__stats['rejected'] += 1
+            return False
+
+    def record(self, success, elapsed_ms=0):
+        """
+        Record the result of a call
+        :param success:
+            False if the call failed
+        :param elapsed_ms:
+            Duration of the call
+        """
+        slow = elapsed_ms >= self.slow_call_ms
+        with self.__lock:
+            if self.__current_state() == HALF_OPEN:
+                if success and not slow:
+                    self.__state = CLOSED
+                    self.__calls.clear()
+                else:
+                    self.__open()
+                return
+
+            self.__calls.append((not success, slow))
+            if len(self.__calls) < self.min_calls:
+                return
+            failures = sum(1 for failed, _ in self.__calls if failed)
+            slows = sum(1 for _, is_slow in self.__calls if is_slow)
+            if (failures / len(self.__calls) >= self.failure_rate
+                    or slows / len(self.__calls) >= self.slow_call_rate):
+                self.__open()
+
+    @contextmanager
+    def guard(self, ignore=()):
+        """
+        Run a block through the circuit
+        :param ignore:
+            Exceptions that do not count as failures
+        :raises CircuitOpenError:
+            If the circuit rejects the call
+        """
+        if not self.allow():
+            raise CircuitOpenError('Circuito abierto')
+        start = time.perf_counter()
+        try:
+            yield
+        except ignore:
+            self.record(True, (time.perf_counter() - start) * 1000)
+            raise
+        except BaseException:
+            # Also cancellations (asyncio.CancelledError), so a trial call
+            # that times out releases the half open state
+            self.record(False, (time.perf_counter() - start) * 1000)
+            raise
+        self.record(True, (time.perf_counter() - start) * 1000)
+
+    def stats(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['state'] = self.__current_state()
+            stats['calls'] = len(self.__calls)
+        return stats
+
+    def __current_state(self):
+        if self.__state == OPEN and time.monotonic() - self.__opened_at >= self.open_seconds:
+            self.__state = HALF_OPEN
+            self.__trials = 0
+        return self.__state
+
+    def __open(self):
+        self.__state = OPEN
+        self.__opened_at = time.monotonic()
+        self.__calls.clear()
+        self.__stats['opened'] += 1
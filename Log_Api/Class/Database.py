@@ -1,5 +1,8 @@
 import os
-from sqlalchemy import create_engine
+import time
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.pool import QueuePool, NullPool
@@ -7,42 +10,255 @@ from sqlalchemy.pool import QueuePool, NullPool
 from ..Utils import Aws
 
 #Excepciones
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm.exc import FlushError
 
 base_class = declarative_base()  # Extend class for models
 
+# Pool settings, tuned for Lambda: one container serves one request at a time,
+# and it can be frozen for minutes between invocations, so connections are
+# pinged on checkout and recycled before MySQL's wait_timeout drops them.
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 1))
+POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', 2))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 280))
+POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))
+CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+# Fail-fast engines, used by the log writes: a degraded database must not
+# hang the Lambda, so their pool and driver timeouts are tight and capped by
+# the deadline of the block (see Database.deadline). Queries and batch jobs
+# use the default engines, without read and write timeouts.
+FAIL_FAST_POOL_TIMEOUT = float(os.getenv('LOG_API_DB_POOL_TIMEOUT', 1))
+FAIL_FAST_CONNECT_TIMEOUT = float(os.getenv('LOG_API_DB_CONNECT_TIMEOUT', 2))
+FAIL_FAST_READ_TIMEOUT = float(os.getenv('LOG_API_DB_READ_TIMEOUT', 3))
+FAIL_FAST_WRITE_TIMEOUT = float(os.getenv('LOG_API_DB_WRITE_TIMEOUT', 3))
+# Lowest driver timeout set from a deadline, in seconds
+MIN_DRIVER_TIMEOUT = 0.1
+
+
+class EngineRegistry():
+    """
+    Process-wide registry of engines and session makers.
+    One engine is created per (mode, APP, STAGE) and reused by every
+    `Database` instance while the Lambda container is warm, plus a
+    fail-fast engine per key for the log writes.
+    """
+    _engines = {}
+    _lock = threading.Lock()
+    _deadline = threading.local()
+
+    @classmethod
+    def key(cls, mode, fail_fast=False):
+        key = (mode, os.getenv("APP", ""), os.getenv("STAGE", ""))
+        return key + ('fail_fast',) if fail_fast else key
+
+    @classmethod
+    def get(cls, mode, fail_fast=False):
+        """
+        Get the registry entry for the mode, creating the engine on first use
+        :param mode:
+            dbr or dbw
+        :param fail_fast:
+            True for the engine with tight timeouts
+        :return:
+            dict with the engine, the session maker and the pool counters
+        """
+        key = cls.key(mode, fail_fast)
+        entry = cls._engines.get(key)
+        if entry is not None:
+            return entry
+
+        with cls._lock:
+            entry = cls._engines.get(key)
+            if entry is None:
+                entry = cls.__create(mode, fail_fast)
+                cls._engines[key] = entry
+        return entry
+
+    @classmethod
+    def time_left(cls):
+        """
+        Seconds left until the deadline of the current thread, None if no
+        deadline is set
+        """
+        deadline = getattr(cls._deadline, 'at', None)
+        if deadline is None:
+            return None
+        return max(deadline - time.monotonic(), MIN_DRIVER_TIMEOUT)
+
+    @classmethod
+    def __create(cls, mode, fail_fast=False):
+        connection_data = Aws(f'{mode}{os.getenv("APP", "")}').get_secret()
+
+        if fail_fast:
+            timeouts = {
+                'connect_timeout': FAIL_FAST_CONNECT_TIMEOUT,
+                'read_timeout': FAIL_FAST_READ_TIMEOUT,
+                'write_timeout': FAIL_FAST_WRITE_TIMEOUT
+            }
+        else:
+            timeouts = {'connect_timeout': CONNECT_TIMEOUT}
+        engine = create_engine(
+            Database.get_connection_strings(connection_data),
+            poolclass=QueuePool,
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_recycle=POOL_RECYCLE,
+            pool_timeout=FAIL_FAST_POOL_TIMEOUT if fail_fast else POOL_TIMEOUT,
+            pool_pre_ping=True,
+            connect_args=timeouts
+        )
+        entry = {
+            'engine': engine,
+            'session_maker': sessionmaker(bind=engine),
+            'connects': 0,
+            'checkouts': 0
+        }
+
+        def on_connect(dbapi_connection, connection_record):
+            entry['connects'] += 1
+
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            entry['checkouts'] += 1
+            if fail_fast:
+                # Pooled connections keep the timeouts of the previous deadline
+                left = cls.time_left()
+                for name in ('read_timeout', 'write_timeout'):
+                    timeout = timeouts[name] if left is None else min(timeouts[name], left)
+                    setattr(dbapi_connection, f'_{name}', timeout)
+
+        def on_do_connect(dialect, connection_record, cargs, cparams):
+            left = cls.time_left()
+            if left is not None:
+                for name in timeouts:
+                    cparams[name] = min(cparams[name], left)
+
+        event.listen(engine, 'connect', on_connect)
+        event.listen(engine, 'checkout', on_checkout)
+        if fail_fast:
+            event.listen(engine, 'do_connect', on_do_connect)
+        return entry
+
+    @classmethod
+    def dispose(cls, mode=None):
+        """
+        Dispose the engines of the registry, closing their pooled connections
+        :param mode:
+            dbr or dbw, if None all the engines are disposed
+        """
+        with cls._lock:
+            if mode is None:
+                keys = list(cls._engines)
+            else:
+                keys = [cls.key(mode), cls.key(mode, fail_fast=True)]
+            for key in keys:
+                entry = cls._engines.pop(key, None)
+                if entry is not None:
+                    entry['engine'].dispose()
+
+    @classmethod
+    def stats(cls):
+        """
+        Get the pool stats of every registered engine
+        :return:
+            dict keyed by "mode:APP:STAGE" with checked out connections,
+            overflow, new connections, checkouts and reused checkouts
+        """
+        stats = {}
+        for key, entry in list(cls._engines.items()):
+            pool = entry['engine'].pool
+            stats[':'.join(key)] = {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+                'connects': entry['connects'],
+                'checkouts': entry['checkouts'],
+                'reused': entry['checkouts'] - entry['connects']
+            }
+        return stats
+
+
 class Database():
-    
+
     # Mode can be:
     # dbr: Mode Read
     # dbw: Mode Write
-    def __init__(self, mode):
+    # fail_fast=True uses the engine with tight timeouts of the log writes
+    def __init__(self, mode, fail_fast=False):
         if mode is None or (mode != "dbw" and mode != "dbr"):
             raise Warning("El modo de uso de base de datos no es válido.")
 
         try:
-            connection_data = Aws(f'{mode}{os.getenv("APP", "")}').get_secret()
-
-            # Get connections strings from secret manager
-            __connection_strings = self.__get_connection_strings(
-                connection_data)
-
-            # Create a engine DB
-            self.__engine = create_engine(
-                __connection_strings,
-                poolclass=QueuePool
-            )
-            # Create the association between the engine and the session
-            self.__session_maker = sessionmaker(bind=self.__engine)
+            entry = EngineRegistry.get(mode, fail_fast)
+            # Engine shared by every session of the container
+            self.__engine = entry['engine']
             # Create a new session
-            self.session = self.__session_maker()
+            self.session = entry['session_maker']()
 
         except Exception as e:
             print(f'Error en conexion Base de datos: {e}')
             raise Exception('Error en conexion Base de datos')
 
-    def __get_connection_strings(self, credentials_data):
+    @property
+    def engine(self):
+        return self.__engine
+
+    @classmethod
+    def dispose(cls, mode=None):
+        """
+        Close the pooled connections, for example before the container is
+        frozen or after a credentials rotation
+        :param mode:
+            dbr or dbw, if None all the engines are disposed
+        """
+        EngineRegistry.dispose(mode)
+
+    @staticmethod
+    @contextmanager
+    def deadline(seconds):
+        """
+        Cap the driver timeouts of the fail-fast sessions used in the block
+        by the current thread, so they end before the deadline
+        :param seconds:
+            Seconds until the deadline, None for the timeouts of the engine
+        """
+        previous = getattr(EngineRegistry._deadline, 'at', None)
+        EngineRegistry._deadline.at = None if seconds is None else time.monotonic() + seconds
+        try:
+            yield
+        finally:
+            EngineRegistry._deadline.at = previous
+
+    @classmethod
+    def handle_auth_failure(cls, mode, exception):
+        """
+        If the database rejected the credentials (MySQL error 1045), drop the
+        cached secret and the engine so the next `Database(mode)` refetches
+        the rotated password once
+        :param mode:
+            dbr or dbw
+        :param exception:
+            Exception raised by the session
+        :return:
+            True if the exception was an authentication failure
+        """
+        if not isinstance(exception, OperationalError):
+            return False
+        args = getattr(exception.orig, 'args', ())
+        if not args or args[0] != 1045:
+            return False
+        Aws(f'{mode}{os.getenv("APP", "")}').invalidate_secret()
+        EngineRegistry.dispose(mode)
+        return True
+
+    @classmethod
+    def pool_stats(cls):
+        """
+        Get the stats of the connection pools
+        """
+        return EngineRegistry.stats()
+
+    @staticmethod
+    def get_connection_strings(credentials_data):
         """
         Get the connection strings from the credentials
         :param credentials_data:
@@ -0,0 +1,215 @@
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from botocore.exceptions import ClientError
+from .Database import Database, IntegrityError
+from ..Models.Idempotency import IdempotencyKey
+from ..Utils.Aws import Aws
+from ..Utils.Cache import TTLCache
+from ..Utils.Json import dumps, loads
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+# Seconds a key blocks the retries of its request
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', 3600))
+
+
+class IdempotencyStore(ABC):
+    """
+    Store of the requests already seen. `claim` is atomic: only the first
+    call with a key gets None, the next ones get the saved record until the
+    key expires.
+    """
+
+    @abstractmethod
+    def claim(self, key):
+        """
+        Claim a key for the current request
+        :return:
+            None if the key was claimed, else a dict with the status and the
+            saved response of the first request
+        """
+
+    @abstractmethod
+    def complete(self, key, response):
+        """
+        Save the response of a claimed key
+        :param response:
+            Response of the handler, None to keep only the status
+        """
+
+    @staticmethod
+    def _encode(response):
+        if response is None:
+            return None
+        try:
+            return dumps(response)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _decode(response):
+        return None if response is None else loads(response)
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """
+    Keys of the container in a TTLCache, limited to `max_keys` (the least
+    recently used are evicted). Retries handled by other containers are not
+    seen; use it as the local stand-in of the shared stores.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_keys=None):
+        if max_keys is None:
+            max_keys = int(os.getenv('IDEMPOTENCY_MAX_KEYS', 10000))
+        self.__cache = TTLCache(ttl=ttl, max_size=max_keys)
+        self.__lock = threading.Lock()
+
+    def claim(self, key):
+        with self.__lock:
+            record = self.__cache.get(key)
+            if record is not None:
+                return record
+            self.__cache.set(key, {'status': IN_PROGRESS, 'response': None})
+        return None
+
+    def complete(self, key, response):
+        # The response is copied through JSON so later changes do not leak in
+        self.__cache.set(key, {'status': COMPLETED,
+                               'response': self._decode(self._encode(response))})
+
+    def stats(self):
+        return self.__cache.stats()
+
+
+class DatabaseIdempotencyStore(IdempotencyStore):
+    """
+    Keys in the IDEMPOTENCY_KEYS table, claimed with an insert on its
+    primary key. Expired keys are claimed again with a conditional update.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, mode='dbw'):
+        self.ttl = ttl
+        self.mode = mode
+
+    def claim(self, key):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        session = Database(self.mode).session
+        try:
+            session.add(IdempotencyKey(KEY=key, STATUS=IN_PROGRESS, EXPIRES_AT=expires_at))
+            session.commit()
+            return None
+        except IntegrityError:
+            session.rollback()
+            claimed = session.query(IdempotencyKey).filter(
+                IdempotencyKey.KEY == key,
+                IdempotencyKey.EXPIRES_AT <= now
+            ).update({'STATUS': IN_PROGRESS, 'RESPONSE': None, 'EXPIRES_AT': expires_at},
+                     synchronize_session=False)
+            session.commit()
+            if claimed:
+                return None
+            row = session.query(IdempotencyKey.STATUS, IdempotencyKey.RESPONSE).filter(
+                IdempotencyKey.KEY == key).first()
+            if row is None:
+                return {'status': IN_PROGRESS, 'response': None}
+            return {'status': row.STATUS, 'response': self._decode(row.RESPONSE)}
+        except Exception as e:
+            session.rollback()
+            Database.handle_auth_failure(self.mode, e)
+            raise e
+        finally:
+            session.close()
+
+    def complete(self, key, response):
+        session = Database(self.mode).session
+        try:
+            session.query(IdempotencyKey).filter(IdempotencyKey.KEY == key).update(
+                {'STATUS': COMPLETED, 'RESPONSE': self._encode(response)},
+                synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            Database.handle_auth_failure(self.mode, e)
+            raise e
+        finally:
+            session.close()
+
+    def purge(self, batch_size=1000):
+        """
+        Delete up to `batch_size` expired keys
+        :return:
+            Number of deleted keys
+        """
+        session = Database(self.mode).session
+        try:
+            keys = [row.KEY for row in session.query(IdempotencyKey.KEY).filter(
+                IdempotencyKey.EXPIRES_AT <= datetime.utcnow()).limit(batch_size)]
+            if keys:
+                session.query(IdempotencyKey).filter(IdempotencyKey.KEY.in_(keys)).delete(
+                    synchronize_session=False)
+            session.commit()
+            return len(keys)
+        except Exception as e:
+            session.rollback()
+            Database.handle_auth_failure(self.mode, e)
+            raise e
+        finally:
+            session.close()
+
+
+class DynamoDBIdempotencyStore(IdempotencyStore):
+    """
+    Keys in a DynamoDB table with a string partition key `id`, claimed with
+    a conditional put. `expiration` is an epoch in seconds, enable it as the
+    TTL attribute of the table to delete the expired keys.
+    """
+
+    def __init__(self, table_name=None, ttl=IDEMPOTENCY_TTL):
+        table_name = table_name or os.getenv('IDEMPOTENCY_TABLE')
+        if not table_name:
+            raise ValueError('DynamoDBIdempotencyStore requiere table_name o IDEMPOTENCY_TABLE')
+        self.table_name = table_name
+        self.ttl = ttl
+
+    def claim(self, key):
+        now = int(time.time())
+        client = Aws.get_client('dynamodb')
+        try:
+            client.put_item(
+                TableName=self.table_name,
+                Item={'id': {'S': key}, 'status': {'S': IN_PROGRESS},
+                      'expiration': {'N': str(now + int(self.ttl))}},
+                ConditionExpression='attribute_not_exists(#id) OR #expiration <= :now',
+                ExpressionAttributeNames={'#id': 'id', '#expiration': 'expiration'},
+                ExpressionAttributeValues={':now': {'N': str(now)}}
+            )
+            return None
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise e
+
+        item = client.get_item(TableName=self.table_name, Key={'id': {'S': key}},
+                               ConsistentRead=True).get('Item', {})
+        return {'status': item.get('status', {}).get('S', IN_PROGRESS),
+                'response': self._decode(item.get('response', {}).get('S'))}
+
+    def complete(self, key, response):
+        values = {':status': {'S': COMPLETED}}
+        update = 'SET #status = :status'
+        encoded = self._encode(response)
+        if encoded is not None:
+            values[':response'] = {'S': encoded}
+            update += ', #response = :response'
+        Aws.get_client('dynamodb').update_item(
+            TableName=self.table_name,
+            Key={'id': {'S': key}},
+            UpdateExpression=update,
+            ExpressionAttributeNames={'#status': 'status', '#response': 'response'}
+            if encoded is not None else {'#status': 'status'},
+            ExpressionAttributeValues=values
+        )
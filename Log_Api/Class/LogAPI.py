@@ -1,94 +1,630 @@
-from json import dumps
+import os
+import math
+import uuid
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from time import perf_counter_ns, monotonic
 from .Database import Database, IntegrityError
+from .LogShipper import get_shipper
+from .LogSpill import get_spill_buffer
+from .CircuitBreaker import CircuitBreaker, CLOSED
+from .LogPolicy import LogPolicy
 from ..Models.LogAPI import LogAPI
+from ..Utils.Json import Fragments
 
-def log_resquest_response(api_func):
+try:
+    from .AsyncDatabase import AsyncDatabase
+except ImportError:
+    AsyncDatabase = None
+
+# Max seconds to wait for the queue before returning the response
+FLUSH_TIMEOUT = float(os.getenv('LOG_API_FLUSH_TIMEOUT', 2))
+
+# Payload columns cut to the max_bytes of the policy
+TRUNCATED_FIELDS = ('HEADERS', 'BODY', 'QUERY_STR_PARAMETERS', 'COOKIES', 'REQUEST_CONTEXT',
+                    'AWS_CONTEXT', 'HEADERS_RESPONSE', 'BODY_RESPONSE')
+
+# Min seconds between automatic replays of the spilled logs
+REPLAY_INTERVAL = float(os.getenv('LOG_API_REPLAY_INTERVAL', 60))
+
+# Spilled logs inserted by each automatic replay, one batch per invocation
+REPLAY_BATCH_SIZE = int(os.getenv('LOG_API_REPLAY_BATCH_SIZE', 100))
+
+# Time kept for the invocation to return after a write; writes are skipped
+# (spilled) when the time left after it does not cover the p95 of the recent writes
+MIN_REMAINING_MS = int(os.getenv('LOG_API_MIN_REMAINING_MS', 1000))
+
+# Circuit breaker of the log database writes
+breaker = CircuitBreaker(
+    failure_rate=float(os.getenv('LOG_API_BREAKER_FAILURE_RATE', 0.5)),
+    slow_call_ms=float(os.getenv('LOG_API_BREAKER_SLOW_MS', 1000)),
+    slow_call_rate=float(os.getenv('LOG_API_BREAKER_SLOW_RATE', 0.5)),
+    window=int(os.getenv('LOG_API_BREAKER_WINDOW', 20)),
+    min_calls=int(os.getenv('LOG_API_BREAKER_MIN_CALLS', 5)),
+    open_seconds=float(os.getenv('LOG_API_BREAKER_OPEN_SECONDS', 30))
+)
+
+# The first invocation of the container is a cold start
+__container = {'cold_start': True, 'replayed_at': 0}
+
+# Durations of the last log writes, in ms
+__write_ms = deque(maxlen=int(os.getenv('LOG_API_BREAKER_WINDOW', 20)))
+
+def log_resquest_response(api_func=None, single_write=False, asynchronous=False,
+                          flush_on_return=True, policy=None, on_metrics=None):
+    """
+    Decorator to log the request and the response of the API in LOG_APIS.
+    By default the request is inserted before the handler runs and updated
+    with the response. With `single_write=True` the request is kept in memory
+    and a single row is inserted after the handler returns; if the handler
+    raises, the request is still logged without response.
+    With `asynchronous=True` the row is enqueued and written by a background
+    thread; `flush_on_return` waits for the queue, bounded by the remaining
+    time of the invocation, before returning the response.
+    `policy` is a LogPolicy, or a dict of routeKey to LogPolicy, that sets
+    truncation, skipped bodies, headers and sampling; routes with sampling
+    are always logged with a single write.
+    The handler time, request/response sizes, logging overhead and cold start
+    are saved in the log and passed as a dict to `on_metrics`, if given.
+    Logs that cannot be written are spilled to a local file and replayed
+    once the database accepts writes again. Writes go through a circuit
+    breaker and are spilled without trying the database when the circuit is
+    open or less than LOG_API_MIN_REMAINING_MS are left in the invocation.
+    """
+    if api_func is None:
+        def wrapper_wrapper(api_func):
+            return log_resquest_response(
+                api_func, single_write=single_write, asynchronous=asynchronous,
+                flush_on_return=flush_on_return, policy=policy, on_metrics=on_metrics)
+        return wrapper_wrapper
+
+    @wraps(api_func)
     def wrapper(*args, **kwargs):
-        request = __request(*args, **kwargs)
-        response = api_func(*args, **kwargs)
-        __response(request, response)
+        start = perf_counter_ns()
+        event = args[0]
+        # Each event and response fragment is serialized once per invocation
+        fragments = Fragments.of(args[1] if len(args) > 1 else kwargs.get('context'))
+        route_policy = LogPolicy.for_route(policy, event.get('routeKey'))
+        metrics = {
+            'route_key': event.get('routeKey'),
+            'cold_start': __container.pop('cold_start', False),
+            'request_bytes': __size(event.get('body'), fragments)
+        }
+
+        if single_write or asynchronous or (route_policy and route_policy.samples):
+            if asynchronous:
+                save = __enqueue
+            else:
+                save = lambda values: __save_or_spill(values, *args, **kwargs)
+            values = __build_request(*args, policy=route_policy, **kwargs)
+            overhead = perf_counter_ns() - start
+            handler_start = perf_counter_ns()
+            try:
+                response = api_func(*args, **kwargs)
+            except Exception:
+                metrics['handler_ms'] = (perf_counter_ns() - handler_start) / 1e6
+                metrics['log_overhead_ms'] = overhead / 1e6
+                values.update(__build_metrics(metrics))
+                save(values)
+                __emit(on_metrics, metrics)
+                raise
+            after = perf_counter_ns()
+            metrics['handler_ms'] = (after - handler_start) / 1e6
+
+            values.update(__build_response(response, route_policy, fragments))
+            metrics['status_code'] = values.get('STATUS_CODE')
+            metrics['response_bytes'] = __size(response.get('body'), fragments) if response else None
+            if route_policy is None or route_policy.sampled(values.get('STATUS_CODE')):
+                metrics['log_overhead_ms'] = (overhead + perf_counter_ns() - after) / 1e6
+                values.update(__build_metrics(metrics))
+                save(values)
+                if asynchronous and flush_on_return:
+                    __flush(*args, **kwargs)
+            metrics['log_overhead_ms'] = (overhead + perf_counter_ns() - after) / 1e6
+            __emit(on_metrics, metrics)
+            return response
+
+        values = __build_request(*args, policy=route_policy, **kwargs)
+        values.update(__build_metrics(metrics))
+        request = None
+        if __has_budget(*args, **kwargs):
+            try:
+                request = __save(values, __write_budget(*args, **kwargs))
+            except Exception as e:
+                # The complete log is saved after the handler
+                logging.error(f'Error guardando log de la api: {e}')
+        overhead = perf_counter_ns() - start
+        handler_start = perf_counter_ns()
+        try:
+            response = api_func(*args, **kwargs)
+        except Exception:
+            if request is None:
+                __spill(values)
+            raise
+        after = perf_counter_ns()
+        metrics['handler_ms'] = (after - handler_start) / 1e6
+        metrics['status_code'] = response.get('statusCode') if response else None
+        metrics['response_bytes'] = __size(response.get('body'), fragments) if response else None
+        metrics['log_overhead_ms'] = (overhead + perf_counter_ns() - after) / 1e6
+        response_values = __build_response(response, route_policy, fragments)
+        values.update(response_values)
+        values.update(__build_metrics(metrics))
+        if request is None:
+            __save_or_spill(values, *args, **kwargs)
+        elif not __has_budget(*args, **kwargs):
+            __spill(values)
+        else:
+            try:
+                __response(request, response_values, __build_metrics(metrics),
+                           __write_budget(*args, **kwargs))
+            except Exception as e:
+                # The replay completes the response of the inserted row
+                logging.error(f'Error guardando respuesta de la api: {e}')
+                __spill(values)
+        metrics['log_overhead_ms'] = (overhead + perf_counter_ns() - after) / 1e6
+        __emit(on_metrics, metrics)
+        return response
+    return wrapper
+
+def async_log_resquest_response(api_func=None, policy=None, on_metrics=None):
+    """
+    Decorator to log the request and the response of a coroutine handler
+    with an async engine (see AsyncDatabase). The request is inserted while
+    the handler runs and the row is updated with the response after it
+    returns. Routes with sampling are inserted once after the handler.
+    Use it under `async_handler`.
+    """
+    if api_func is None:
+        def wrapper_wrapper(api_func):
+            return async_log_resquest_response(api_func, policy=policy, on_metrics=on_metrics)
+        return wrapper_wrapper
+
+    if AsyncDatabase is None:
+        raise ImportError('async_log_resquest_response requiere SQLAlchemy 1.4+ con asyncio')
+
+    @wraps(api_func)
+    async def wrapper(event, context):
+        start = perf_counter_ns()
+        fragments = Fragments.of(context)
+        route_policy = LogPolicy.for_route(policy, event.get('routeKey'))
+        metrics = {
+            'route_key': event.get('routeKey'),
+            'cold_start': __container.pop('cold_start', False),
+            'request_bytes': __size(event.get('body'), fragments)
+        }
+        values = __build_request(event, context, route_policy)
+        values.update(__build_metrics(metrics))
+
+        request_task = None
+        if not (route_policy and route_policy.samples) and __has_budget(event, context):
+            request_task = asyncio.ensure_future(
+                asyncio.wait_for(__save_async(dict(values)), __write_budget(event, context)))
+        overhead = perf_counter_ns() - start
+        handler_start = perf_counter_ns()
+        try:
+            response = await api_func(event, context)
+        except Exception:
+            metrics['handler_ms'] = (perf_counter_ns() - handler_start) / 1e6
+            metrics['log_overhead_ms'] = overhead / 1e6
+            values.update(__build_metrics(metrics))
+            if await __request_id(request_task) is None:
+                await __save_or_spill_async(values, event, context)
+            __emit(on_metrics, metrics)
+            raise
+        after = perf_counter_ns()
+        metrics['handler_ms'] = (after - handler_start) / 1e6
+        metrics['status_code'] = response.get('statusCode') if response else None
+        metrics['response_bytes'] = __size(response.get('body'), fragments) if response else None
+        metrics['log_overhead_ms'] = (overhead + perf_counter_ns() - after) / 1e6
+
+        response_values = __build_response(response, route_policy, fragments)
+        response_values.update(__build_metrics(metrics))
+        values.update(response_values)
+        request_id = await __request_id(request_task)
+        if request_id is None:
+            if route_policy is None or route_policy.sampled(values.get('STATUS_CODE')):
+                await __save_or_spill_async(values, event, context)
+        elif not __has_budget(event, context):
+            __spill(values)
+        else:
+            try:
+                await asyncio.wait_for(__update_async(request_id, response_values),
+                                       __write_budget(event, context))
+            except Exception as e:
+                # The replay completes the response of the inserted row
+                logging.error(f'Error guardando respuesta de la api: {e}')
+                __spill(values)
+        metrics['log_overhead_ms'] = (overhead + perf_counter_ns() - after) / 1e6
+        __emit(on_metrics, metrics)
         return response
     return wrapper
 
-def __request(event, context):
-    session = Database('dbw').session
+async def __save_async(values):
+    """
+    Insert a log with the async engine
+    :return:
+        ID of the log
+    """
+    with __guard():
+        session = AsyncDatabase('dbw').session
+        try:
+            log_api = LogAPI(**values)
+            session.add(log_api)
+            await session.commit()
+            return log_api.ID
+        except Exception as e:
+            await session.rollback()
+            await AsyncDatabase.handle_auth_failure('dbw', e)
+            raise e
+        finally:
+            await session.close()
+
+async def __update_async(id_log, values):
+    """
+    Update a log with the async engine, without reading it first
+    """
+    table = LogAPI.__table__
+    with __guard():
+        session = AsyncDatabase('dbw').session
+        try:
+            await session.execute(table.update().where(table.c.ID == id_log).values(**values))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            await AsyncDatabase.handle_auth_failure('dbw', e)
+            raise e
+        finally:
+            await session.close()
+
+async def __request_id(request_task):
+    """
+    Wait for the insert of the request, None if it was not inserted
+    """
+    if request_task is None:
+        return None
     try:
-        method, path = event['routeKey'].split(" ")
-        raw_query_str = event.get('rawQueryString', None)
-        
-        headers = event['headers']
-        user_agent = headers.get('user-agent', None)
-        
-        request_context = event['requestContext']
-        
-        host = headers['host'] if headers.get(
-            'host') else request_context['domainName']
-        
-        # method = request_context['http']['method']
-        # path = request_context['http']['path']
-        query_str = event.get('queryStringParameters', None)
-        path_parameters = event.get('pathParameters', None)
-        
-        ip = request_context['identity']['sourceIp'] if request_context.get(
-            'identity') else request_context['http']['sourceIp']
-        
-        username = request_context.get('authorizer', {}).get('jwt', {}).get('claims', {}).get('username', None) 
-        
-        time = request_context.get('time', None)
-        body = event.get('body', {})
-        cookies = event.get('cookies', None)
-        
-        log_api = LogAPI(
-            USERNAME=username,
-            PATH=path,
-            DOMAIN_NAME=host,
-            METHOD=method,
-            HEADERS=dumps(headers) if headers else None,
-            BODY=dumps(body) if body else None,
-            QUERY_STR_PARAMETERS=dumps(query_str) if query_str else None,
-            PATH_PARAMETERS=path_parameters,
-            COOKIES=dumps(cookies) if cookies else None,
-            RAW_QUERY_STR=raw_query_str if raw_query_str else None,
-            REQUEST_CONTEXT=dumps(request_context),
-            AWS_CONTEXT=str(context),
-            IP=ip,
-            USER_AGENT=user_agent,
-            TIME=time
-        )
-        session.add(log_api)
-        session.commit()
-        return log_api
-    except IntegrityError as e:
-        session.rollback()
-        raise e
+        return await request_task
     except Exception as e:
-        raise e
-    finally:
-        session.invalidate()
-        session.close()
+        # The complete log is saved after the handler
+        logging.error(f'Error guardando log de la api: {e}')
+        return None
 
+async def __save_or_spill_async(values, event=None, context=None):
+    if not __has_budget(event, context):
+        __spill(values)
+        return
+    try:
+        await asyncio.wait_for(__save_async(values), __write_budget(event, context))
+    except Exception as e:
+        logging.error(f'Error guardando log de la api: {e}')
+        __spill(values)
 
-def __response(request, response):
+def __size(body, fragments=None):
     """
-    Log response
-    request: SQLAlchemy object
-        Object of the request to log
+    Bytes of a request or response body
+    """
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    return len((fragments or Fragments()).dumps_bytes(body))
+
+def __build_metrics(metrics):
+    """
+    Get the LogAPI column values of the metrics. The logging overhead saved
+    is the one measured before the final write
+    """
+    return dict(
+        HANDLER_MS=metrics.get('handler_ms'),
+        REQUEST_BYTES=metrics.get('request_bytes'),
+        RESPONSE_BYTES=metrics.get('response_bytes'),
+        LOG_OVERHEAD_MS=metrics.get('log_overhead_ms'),
+        COLD_START=metrics.get('cold_start')
+    )
+
+def __emit(on_metrics, metrics):
+    if on_metrics is None:
+        return
+    try:
+        on_metrics(metrics)
+    except Exception as e:
+        logging.error(f'Error en on_metrics: {e}')
+
+def __build_request(event, context, policy=None):
+    """
+    Get the LogAPI column values of the request
+    event: dict
+        Event of API Gateway
+    context: LambdaContext
+        Context of the lambda
+    policy: LogPolicy
+        Policy of the route (optional)
+    """
+    dumps = Fragments.of(context).dumps
+    method, path = event['routeKey'].split(" ")
+    raw_query_str = event.get('rawQueryString', None)
+
+    headers = event['headers']
+    user_agent = headers.get('user-agent', None)
+
+    request_context = event['requestContext']
+
+    host = headers['host'] if headers.get(
+        'host') else request_context['domainName']
+
+    # method = request_context['http']['method']
+    # path = request_context['http']['path']
+    query_str = event.get('queryStringParameters', None)
+    path_parameters = event.get('pathParameters', None)
+
+    ip = request_context['identity']['sourceIp'] if request_context.get(
+        'identity') else request_context['http']['sourceIp']
+
+    username = request_context.get('authorizer', {}).get('jwt', {}).get('claims', {}).get('username', None)
+
+    time = request_context.get('time', None)
+    body = event.get('body', {})
+    cookies = event.get('cookies', None)
+
+    if policy is not None:
+        if policy.skip_body(headers):
+            body = None
+        headers = policy.headers(headers)
+
+    return __apply_policy(dict(
+        REQUEST_ID=str(uuid.uuid4()),
+        USERNAME=username,
+        PATH=path,
+        DOMAIN_NAME=host,
+        METHOD=method,
+        HEADERS=dumps(headers) if headers is not None else None,
+        BODY=dumps(body) if body else None,
+        QUERY_STR_PARAMETERS=dumps(query_str) if query_str else None,
+        PATH_PARAMETERS=path_parameters,
+        COOKIES=dumps(cookies) if cookies else None,
+        RAW_QUERY_STR=raw_query_str if raw_query_str else None,
+        REQUEST_CONTEXT=dumps(request_context),
+        AWS_CONTEXT=str(context),
+        IP=ip,
+        USER_AGENT=user_agent,
+        TIME=time,
+        REQUEST_TIME=__parse_time(request_context)
+    ), policy)
+
+def __parse_time(request_context):
+    """
+    Get the UTC datetime of the request from the request context
+    request_context: dict
+        requestContext of the event, HTTP API (timeEpoch, time) or
+        REST API (requestTimeEpoch, requestTime)
+    """
+    epoch = request_context.get('timeEpoch', request_context.get('requestTimeEpoch'))
+    if epoch is not None:
+        return datetime.utcfromtimestamp(int(epoch) / 1000)
+    time = request_context.get('time', request_context.get('requestTime'))
+    if not time:
+        return None
+    try:
+        parsed = datetime.strptime(time, '%d/%b/%Y:%H:%M:%S %z')
+    except ValueError:
+        return None
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+def __build_response(response, policy=None, fragments=None):
+    """
+    Get the LogAPI column values of the response
     response: dict
         Response of the API
+    policy: LogPolicy
+        Policy of the route (optional)
+    fragments: Fragments
+        Serialized fragments of the invocation (optional)
     """
-    session = Database('dbw').session
-    try:
-        if response:
-            log_api = session.merge(request)
-            log_api.STATUS_CODE = response.get('statusCode')
-            log_api.HEADERS_RESPONSE = dumps(response.get('headers', None))
-            log_api.BODY_RESPONSE = dumps(response.get('body', None))
+    dumps = (fragments or Fragments()).dumps
+    if not response:
+        return {}
+    status_code = response.get('statusCode')
+    headers = response.get('headers', None)
+    body = response.get('body', None)
+    if policy is not None:
+        if policy.skip_body(headers, status_code):
+            body = None
+        headers = policy.headers(headers)
+    return __apply_policy(dict(
+        STATUS_CODE=status_code,
+        HEADERS_RESPONSE=dumps(headers),
+        BODY_RESPONSE=dumps(body)
+    ), policy)
+
+def __apply_policy(values, policy):
+    """
+    Truncate the payloads and empty the excluded columns
+    """
+    if policy is None:
+        return values
+    for column in values:
+        if column in policy.exclude_fields and LogAPI.__table__.columns[column].nullable:
+            values[column] = None
+        elif column in TRUNCATED_FIELDS:
+            values[column] = policy.truncate(values[column])
+    return values
+
+@contextmanager
+def __guard(budget=None):
+    """
+    Run a log write through the circuit breaker, with the driver timeouts
+    capped by the write budget (seconds), and record its duration
+    """
+    with breaker.guard(ignore=(IntegrityError,)):
+        start = perf_counter_ns()
+        try:
+            with Database.deadline(budget):
+                yield
+        finally:
+            __write_ms.append((perf_counter_ns() - start) / 1e6)
+
+def __save(values, budget=None):
+    """
+    Insert a fully populated log
+    values: dict
+        LogAPI column values
+    budget: float
+        Seconds the write can take (see __write_budget)
+    """
+    with __guard(budget):
+        session = Database('dbw', fail_fast=True).session
+        try:
+            log_api = LogAPI(**values)
+            session.add(log_api)
             session.commit()
-    except IntegrityError as e:
-        session.rollback()
-        raise e
+            return log_api
+        except IntegrityError as e:
+            session.rollback()
+            raise e
+        except Exception as e:
+            Database.handle_auth_failure('dbw', e)
+            raise e
+        finally:
+            # Return the connection to the pool so the next invocation reuses it
+            session.close()
+
+def __write_budget(event=None, context=None):
+    """
+    Seconds a log write can take without leaving less than
+    LOG_API_MIN_REMAINING_MS in the invocation, None without a Lambda context
+    """
+    if not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return (context.get_remaining_time_in_millis() - MIN_REMAINING_MS) / 1000
+
+def __has_budget(event=None, context=None):
+    """
+    True if the write budget of the invocation covers the p95 of the recent
+    log writes
+    """
+    budget = __write_budget(event, context)
+    if budget is None:
+        return True
+    latencies = sorted(__write_ms.copy())
+    expected_ms = latencies[math.ceil(len(latencies) * 0.95) - 1] if latencies else 0
+    return budget > 0 and budget * 1000 >= expected_ms
+
+def __save_or_spill(values, event=None, context=None):
+    """
+    Insert a log, or spill it to the local file if the database fails or
+    there is no time left in the invocation
+    """
+    if not __has_budget(event, context):
+        __spill(values)
+        return
+    try:
+        __save(values, __write_budget(event, context))
     except Exception as e:
-        raise e
-    finally:
-        session.invalidate()
-        session.close()
\ No newline at end of file
+        logging.error(f'Error guardando log de la api: {e}')
+        __spill(values)
+        return
+    __replay_if_due(event, context)
+
+def __spill(values):
+    try:
+        get_spill_buffer().append(values)
+    except Exception as e:
+        logging.error(f'Error guardando log en el spill: {e}')
+
+def __replay_if_due(event=None, context=None):
+    """
+    Replay one batch of LOG_API_REPLAY_BATCH_SIZE spilled logs, at most once
+    every LOG_API_REPLAY_INTERVAL seconds, through the circuit breaker and
+    only if the invocation has time left for the write
+    """
+    if monotonic() - __container['replayed_at'] < REPLAY_INTERVAL or breaker.state != CLOSED:
+        return
+    __container['replayed_at'] = monotonic()
+    if not get_spill_buffer().pending() or not __has_budget(event, context):
+        return
+    try:
+        # Not recorded in the write durations, a batch is slower than a log
+        with breaker.guard(ignore=(IntegrityError,)):
+            with Database.deadline(__write_budget(event, context)):
+                get_spill_buffer().replay(REPLAY_BATCH_SIZE, max_batches=1, fail_fast=True)
+    except Exception as e:
+        logging.error(f'Error reenviando logs del spill: {e}')
+
+def replay_spilled_logs(batch_size=500, max_batches=None):
+    """
+    Insert the spilled logs in LOG_APIS, meant for a scheduled job
+    :param max_batches:
+        Max batches to insert, None to replay every spilled log
+    :return:
+        dict with the replayed logs and if every spilled log was replayed
+    """
+    return get_spill_buffer().replay(batch_size, max_batches=max_batches)
+
+def __write_queued(values):
+    __save(values)
+    __replay_if_due()
+
+def __enqueue(values):
+    get_shipper(__write_queued, get_spill_buffer().append).put(values)
+
+def __flush(event, context):
+    """
+    Wait for the queued logs without exceeding the time left of the invocation
+    """
+    timeout = FLUSH_TIMEOUT
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        # Keep a margin for the runtime to return the response
+        remaining = context.get_remaining_time_in_millis() / 1000 - 0.5
+        timeout = max(0, min(timeout, remaining))
+    if not get_shipper(__write_queued, get_spill_buffer().append).flush(timeout):
+        logging.warning('Logs de la api pendientes en la cola')
+
+def log_shipper_stats():
+    """
+    Queue depth and counters of the asynchronous logging
+    """
+    return get_shipper(__write_queued, get_spill_buffer().append).stats()
+
+def log_breaker_stats():
+    """
+    State of the circuit breaker of the log database
+    """
+    return breaker.stats()
+
+def __response(request, response_values, metrics=None, budget=None):
+    """
+    Log response
+    request: SQLAlchemy object
+        Object of the request to log
+    response_values: dict
+        LogAPI column values of the response (see __build_response)
+    metrics: dict
+        LogAPI metric columns (optional)
+    budget: float
+        Seconds the write can take (see __write_budget)
+    """
+    with __guard(budget):
+        session = Database('dbw', fail_fast=True).session
+        try:
+            if response_values:
+                log_api = session.merge(request)
+                for column, value in response_values.items():
+                    setattr(log_api, column, value)
+                for column, value in (metrics or {}).items():
+                    setattr(log_api, column, value)
+                session.commit()
+        except IntegrityError as e:
+            session.rollback()
+            raise e
+        except Exception as e:
+            Database.handle_auth_failure('dbw', e)
+            raise e
+        finally:
+            # Return the connection to the pool so the next invocation reuses it
+            session.close()
@@ -0,0 +1,172 @@
+import time
+import logging
+import threading
+from sqlalchemy import insert
+from .Database import Database, IntegrityError
+from .LogSpill import get_spill_buffer
+from ..Models.LogAPI import LogAPI
+
+# MySQL error of a duplicated unique key (REQUEST_ID)
+DUPLICATE_ENTRY = 1062
+
+
+class LogBatchWriter():
+    """
+    Accumulate LogAPI rows and insert them with a single multi-VALUES INSERT
+    when the batch reaches `max_rows` rows or its oldest row is `max_age`
+    seconds old. Rows of a failed INSERT are saved in the spill buffer, and
+    replayed later with replay_spilled_logs; if they cannot be spilled they
+    are kept for the next flush. When the database rejects a row the batch
+    is retried row by row and only the invalid rows (other than a
+    duplicated REQUEST_ID) are dropped.
+
+    with LogBatchWriter(max_rows=200) as writer:
+        for record in event['Records']:
+            writer.add(log_values(record))
+    """
+
+    def __init__(self, max_rows=500, max_age=5.0, mode='dbw', spill=True):
+        """
+        :param max_rows:
+            Rows that trigger a flush
+        :param max_age:
+            Seconds since the first pending row that trigger a flush
+        :param mode:
+            Database mode
+        :param spill:
+            Save the rows of a failed INSERT in the spill buffer, if False
+            they are kept for the next flush
+        """
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.mode = mode
+        self.spill = spill
+        self.__rows = []
+        self.__first_at = None
+        self.__lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def __len__(self):
+        return len(self.__rows)
+
+    def add(self, log):
+        """
+        Add a row to the batch
+        :param log:
+            LogAPI object or dict with its column values
+        :return:
+            Result of the flush if the row triggered one, else None
+        """
+        if isinstance(log, LogAPI):
+            log = self.to_values(log)
+        with self.__lock:
+            if not self.__rows:
+                self.__first_at = time.monotonic()
+            self.__rows.append(log)
+        if self.due():
+            return self.flush()
+        return None
+
+    def due(self):
+        """
+        True if the batch reached the size or age threshold
+        """
+        if not self.__rows:
+            return False
+        return (len(self.__rows) >= self.max_rows
+                or time.monotonic() - self.__first_at >= self.max_age)
+
+    def flush(self):
+        """
+        Insert the pending rows, one statement per set of columns so the
+        missing columns keep their server default. If a row is rejected the
+        batch is inserted row by row: only the invalid rows are dropped and
+        the ones with a duplicated REQUEST_ID are spilled for the replay.
+        :return:
+            dict with the inserted, spilled and dropped rows and the elapsed
+            milliseconds
+        """
+        with self.__lock:
+            rows, self.__rows = self.__rows, []
+            self.__first_at = None
+        if not rows:
+            return {'rows': 0, 'spilled': 0, 'dropped': 0, 'elapsed_ms': 0.0}
+
+        start = time.perf_counter()
+        result = {'rows': len(rows), 'spilled': 0, 'dropped': 0}
+        session = Database(self.mode).session
+        try:
+            # Every row of a multi-VALUES insert must have the same columns
+            groups = {}
+            for row in rows:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            for values in groups.values():
+                session.execute(insert(LogAPI.__table__).values(values))
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            result = self.__insert_rows(session, rows)
+        except Exception as e:
+            session.rollback()
+            Database.handle_auth_failure(self.mode, e)
+            self.__save_failed(rows)
+            raise e
+        finally:
+            session.close()
+        result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+        return result
+
+    def __insert_rows(self, session, rows):
+        result = {'rows': 0, 'spilled': 0, 'dropped': 0}
+        for index, row in enumerate(rows):
+            try:
+                session.execute(insert(LogAPI.__table__).values(row))
+                session.commit()
+                result['rows'] += 1
+            except IntegrityError as e:
+                session.rollback()
+                if getattr(e.orig, 'args', (None,))[0] == DUPLICATE_ENTRY:
+                    self.__save_failed([row])
+                    result['spilled'] += 1
+                else:
+                    # An invalid row would fail again on every retry
+                    logging.error(f'Se descarta un log invalido: {e}')
+                    result['dropped'] += 1
+            except Exception as e:
+                session.rollback()
+                Database.handle_auth_failure(self.mode, e)
+                self.__save_failed(rows[index:])
+                raise e
+        return result
+
+    def __save_failed(self, rows):
+        if self.spill:
+            spill_buffer = get_spill_buffer()
+            try:
+                # The replay skips rows whose REQUEST_ID was already inserted
+                for index, row in enumerate(rows):
+                    spill_buffer.append(row)
+                return
+            except Exception as e:
+                logging.error(f'Error guardando logs en el spill: {e}')
+                rows = rows[index:]
+        with self.__lock:
+            self.__rows = rows + self.__rows
+            self.__first_at = time.monotonic()
+
+    @staticmethod
+    def to_values(log):
+        """
+        Get the column values set in a LogAPI object
+        """
+        values = {}
+        for column in LogAPI.__table__.columns:
+            value = getattr(log, column.key, None)
+            if value is not None:
+                values[column.key] = value
+        return values
@@ -0,0 +1,76 @@
+import time
+from sqlalchemy import Text, bindparam, type_coerce
+from .Database import Database
+from ..Models.LogAPI import LogAPI
+from ..Models.Types import CompressedText
+
+# Columns stored with CompressedText
+COMPRESSED_COLUMNS = [
+    column.key for column in LogAPI.__table__.columns
+    if isinstance(column.type, CompressedText)
+]
+
+
+def backfill_compression(chunk_size=500, start_id=0, max_chunks=None, pause=0.05, mode='dbw'):
+    """
+    Compress the existing rows of LOG_APIS. Rows are read by ID ranges and
+    each chunk is updated in its own short transaction, so the table is not
+    locked. Requires LOG_API_COMPRESSION to be set.
+    :param chunk_size:
+        Rows read and updated per transaction
+    :param start_id:
+        Resume after this ID
+    :param max_chunks:
+        Stop after this number of chunks, None processes the whole table
+    :param pause:
+        Seconds to sleep between chunks to leave room for the writers
+    :param mode:
+        Database mode
+    :return:
+        dict with the last processed ID, the scanned rows and the updated rows
+    """
+    if CompressedText.codec() is None:
+        raise ValueError('La compresion no esta habilitada (LOG_API_COMPRESSION)')
+
+    table = LogAPI.__table__
+    update = table.update().where(table.c.ID == bindparam('row_id'))
+    result = {'last_id': start_id, 'scanned': 0, 'updated': 0}
+    chunks = 0
+
+    while max_chunks is None or chunks < max_chunks:
+        session = Database(mode).session
+        try:
+            # Raw stored values, without decompressing
+            rows = session.query(
+                table.c.ID,
+                *[type_coerce(table.c[column], Text).label(column) for column in COMPRESSED_COLUMNS]
+            ).filter(
+                table.c.ID > result['last_id']
+            ).order_by(table.c.ID).limit(chunk_size).all()
+            if not rows:
+                break
+
+            params = []
+            for row in rows:
+                values = {column: getattr(row, column) for column in COMPRESSED_COLUMNS}
+                compressed = {column: CompressedText.compress(value) for column, value in values.items()}
+                if compressed != values:
+                    compressed['row_id'] = row.ID
+                    params.append(compressed)
+            if params:
+                session.execute(update, params)
+            session.commit()
+
+            result['last_id'] = rows[-1].ID
+            result['scanned'] += len(rows)
+            result['updated'] += len(params)
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+        chunks += 1
+        if pause:
+            time.sleep(pause)
+    return result
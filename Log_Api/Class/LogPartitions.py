@@ -0,0 +1,113 @@
+from datetime import date
+from sqlalchemy import text
+from .Database import Database
+from ..Models.LogAPI import LogAPI
+
+TABLE = LogAPI.__tablename__
+# Partition that receives the rows after the last monthly partition
+MAX_PARTITION = 'pmax'
+
+
+def add_months(month, months):
+    """
+    First day of the month `months` after `month`
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'p{month.year:04d}{month.month:02d}'
+
+
+def __partition(month):
+    upper = add_months(month, 1).strftime('%Y-%m-%d 00:00:00')
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN (UNIX_TIMESTAMP('{upper}'))"
+
+
+def partition_ddl(start, months):
+    """
+    Statements to range-partition LOG_APIS by month of CREATED_AT.
+    MySQL requires the partition column in every unique key, so the primary
+    key becomes (ID, CREATED_AT) and the REQUEST_ID key (REQUEST_ID, CREATED_AT);
+    the spill replay writes the stored CREATED_AT of each REQUEST_ID to match it.
+    Run them once, in a maintenance window.
+    :param start:
+        date of the first monthly partition, older rows go to it too
+    :param months:
+        number of monthly partitions to create
+    :return:
+        list of SQL statements
+    """
+    start = date(start.year, start.month, 1)
+    partitions = [__partition(add_months(start, i)) for i in range(months)]
+    partitions.append(f'PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE')
+    return [
+        f'ALTER TABLE {TABLE} MODIFY CREATED_AT TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP',
+        f'ALTER TABLE {TABLE} DROP PRIMARY KEY, ADD PRIMARY KEY (ID, CREATED_AT)',
+        f'ALTER TABLE {TABLE} DROP INDEX UQ_LOG_APIS_REQUEST_ID, '
+        f'ADD UNIQUE KEY UQ_LOG_APIS_REQUEST_ID (REQUEST_ID, CREATED_AT)',
+        f'ALTER TABLE {TABLE} PARTITION BY RANGE (UNIX_TIMESTAMP(CREATED_AT)) (\n    '
+        + ',\n    '.join(partitions) + '\n)'
+    ]
+
+
+def rotate_partitions(months_ahead=3, retention_months=12, today=None, mode='dbw'):
+    """
+    Keep `months_ahead` future monthly partitions and drop the ones older than
+    `retention_months`. Meant to run in a scheduled Lambda once a day.
+    :param months_ahead:
+        Months after the current one that must have a partition
+    :param retention_months:
+        Months kept before the current one, older partitions are dropped
+    :param today:
+        Reference date, defaults to today
+    :param mode:
+        Database mode
+    :return:
+        dict with the added and dropped partition names
+    """
+    today = today or date.today()
+    current = date(today.year, today.month, 1)
+    result = {'added': [], 'dropped': []}
+
+    session = Database(mode).session
+    try:
+        existing = [row[0] for row in session.execute(text(
+            'SELECT PARTITION_NAME FROM information_schema.PARTITIONS '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table '
+            'AND PARTITION_NAME IS NOT NULL'
+        ), {'table': TABLE})]
+        if MAX_PARTITION not in existing:
+            raise ValueError(f'{TABLE} no esta particionada, ejecute partition_ddl')
+
+        # Only months after the last partition can be split from pmax
+        last = max([name for name in existing if name != MAX_PARTITION], default='')
+        missing = [
+            add_months(current, i) for i in range(months_ahead + 1)
+            if partition_name(add_months(current, i)) > last
+        ]
+        if missing:
+            # New months are split from pmax, which is empty for future dates
+            partitions = [__partition(month) for month in missing]
+            partitions.append(f'PARTITION {MAX_PARTITION} VALUES LESS THAN MAXVALUE')
+            session.execute(text(
+                f'ALTER TABLE {TABLE} REORGANIZE PARTITION {MAX_PARTITION} INTO (\n    '
+                + ',\n    '.join(partitions) + '\n)'
+            ))
+            result['added'] = [partition_name(month) for month in missing]
+
+        oldest = partition_name(add_months(current, -retention_months))
+        expired = [name for name in existing
+                   if name != MAX_PARTITION and name < oldest]
+        if expired:
+            session.execute(text(
+                f'ALTER TABLE {TABLE} DROP PARTITION {", ".join(expired)}'))
+            result['dropped'] = expired
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+    return result
@@ -0,0 +1,104 @@
+import random
+
+# Route key of the policy used when the route has none
+DEFAULT_ROUTE = '$default'
+
+
+class LogPolicy():
+    """
+    What is logged for a route: payload truncation, bodies to skip,
+    headers to keep, columns to leave empty and sampling of successes.
+    """
+
+    def __init__(self, max_bytes=None, skip_body_status=(), skip_body_content_types=(),
+                 header_allowlist=None, header_denylist=(), exclude_fields=(),
+                 sample_rate=1.0):
+        """
+        :param max_bytes:
+            Max bytes of each logged payload, the rest is replaced by a marker
+        :param skip_body_status:
+            Status codes whose response body is not logged
+        :param skip_body_content_types:
+            Content types (or prefixes like "image/") whose body is not logged
+        :param header_allowlist:
+            Only these headers are logged, None logs every header
+        :param header_denylist:
+            Headers that are never logged
+        :param exclude_fields:
+            Nullable LogAPI columns that are not logged, e.g. REQUEST_CONTEXT
+        :param sample_rate:
+            Fraction of successful requests (status < 400) that are logged,
+            errors are always logged
+        """
+        self.max_bytes = max_bytes
+        self.skip_body_status = set(skip_body_status)
+        self.skip_body_content_types = tuple(
+            content_type.lower() for content_type in skip_body_content_types)
+        self.header_allowlist = None if header_allowlist is None else set(
+            header.lower() for header in header_allowlist)
+        self.header_denylist = set(header.lower() for header in header_denylist)
+        self.exclude_fields = set(exclude_fields)
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def for_route(cls, policy, route_key):
+        """
+        Get the policy of a route
+        :param policy:
+            LogPolicy, or dict of routeKey (e.g. "GET /users") to LogPolicy
+            with an optional "$default" entry
+        :param route_key:
+            routeKey of the event
+        """
+        if policy is None or isinstance(policy, LogPolicy):
+            return policy
+        return policy.get(route_key, policy.get(DEFAULT_ROUTE))
+
+    @property
+    def samples(self):
+        return self.sample_rate < 1
+
+    def sampled(self, status_code):
+        """
+        True if the request must be logged
+        """
+        if status_code is None or status_code >= 400:
+            return True
+        return random.random() < self.sample_rate
+
+    def headers(self, headers):
+        """
+        Filter the headers with the allowlist and denylist
+        """
+        if not headers:
+            return headers
+        return {
+            name: value for name, value in headers.items()
+            if name.lower() not in self.header_denylist
+            and (self.header_allowlist is None or name.lower() in self.header_allowlist)
+        }
+
+    def skip_body(self, headers, status_code=None):
+        """
+        True if the body must not be logged for the status code or content type
+        """
+        if status_code is not None and status_code in self.skip_body_status:
+            return True
+        if not self.skip_body_content_types or not headers:
+            return False
+        content_type = next(
+            (value for name, value in headers.items() if name.lower() == 'content-type'), None)
+        return bool(content_type) and str(content_type).lower().startswith(
+            self.skip_body_content_types)
+
+    def truncate(self, text):
+        """
+        Cut the text to max_bytes adding a marker with the removed bytes
+        """
+        if text is None or self.max_bytes is None:
+            return text
+        data = text.encode('utf-8')
+        if len(data) <= self.max_bytes:
+            return text
+        kept = data[:self.max_bytes].decode('utf-8', errors='ignore')
+        return f'{kept}...[truncated {len(data) - self.max_bytes} bytes]'
@@ -0,0 +1,122 @@
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import defer
+from .Database import Database
+from ..Models.LogAPI import LogAPI
+
+# Text columns only loaded when they are requested
+LARGE_COLUMNS = ('HEADERS', 'BODY', 'QUERY_STR_PARAMETERS', 'COOKIES', 'RAW_QUERY_STR',
+                 'REQUEST_CONTEXT', 'AWS_CONTEXT', 'USER_AGENT', 'HEADERS_RESPONSE',
+                 'BODY_RESPONSE')
+
+
+class LogQuery():
+    """
+    Read LOG_APIS through the dbr engine, newest first, with keyset
+    pagination on (CREATED_AT, ID).
+
+    query = LogQuery(path='/users', status_code=[500, 502], start=yesterday)
+    page = query.page(limit=50)
+    next_page = query.page(limit=50, after=page['next'])
+    """
+
+    def __init__(self, start=None, end=None, path=None, method=None, status_code=None,
+                 username=None, ip=None, include=(), mode='dbr'):
+        """
+        :param start:
+            datetime, rows created at or after it
+        :param end:
+            datetime, rows created before it
+        :param path:
+            Route of the api
+        :param method:
+            HTTP method
+        :param status_code:
+            Status code or list of status codes
+        :param username:
+            Username of the request
+        :param ip:
+            Ip of the client
+        :param include:
+            Large text columns to load (e.g. ['BODY']), True loads all of them
+        :param mode:
+            Database mode
+        """
+        self.filters = []
+        if start is not None:
+            self.filters.append(LogAPI.CREATED_AT >= start)
+        if end is not None:
+            self.filters.append(LogAPI.CREATED_AT < end)
+        if path is not None:
+            self.filters.append(LogAPI.PATH == path)
+        if method is not None:
+            self.filters.append(LogAPI.METHOD == method.upper())
+        if isinstance(status_code, (list, tuple, set)):
+            self.filters.append(LogAPI.STATUS_CODE.in_(list(status_code)))
+        elif status_code is not None:
+            self.filters.append(LogAPI.STATUS_CODE == status_code)
+        if username is not None:
+            self.filters.append(LogAPI.USERNAME == username)
+        if ip is not None:
+            self.filters.append(LogAPI.IP == ip)
+
+        deferred = () if include is True else [
+            column for column in LARGE_COLUMNS if column not in include]
+        self.deferred = deferred
+        self.columns = [column.key for column in LogAPI.__table__.columns
+                        if column.key not in deferred]
+        self.mode = mode
+
+    def page(self, limit=100, after=None):
+        """
+        Get a page of logs
+        :param limit:
+            Max rows of the page
+        :param after:
+            `next` cursor of the previous page
+        :return:
+            dict with the rows as dicts and the `next` cursor, None on the last page
+        """
+        session = Database(self.mode).session
+        try:
+            rows = self.__query(session, after).limit(limit).all()
+            items = [self.__to_dict(row) for row in rows]
+        finally:
+            session.close()
+
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = (items[-1]['CREATED_AT'], items[-1]['ID'])
+        return {'items': items, 'next': next_cursor}
+
+    def stream(self, batch_size=500, after=None):
+        """
+        Iterate over every matching log with a server side cursor, fetching
+        `batch_size` rows at a time
+        :return:
+            generator of dicts
+        """
+        session = Database(self.mode).session
+        try:
+            query = self.__query(session, after).execution_options(
+                stream_results=True).yield_per(batch_size)
+            for row in query:
+                yield self.__to_dict(row)
+        finally:
+            session.close()
+
+    def __query(self, session, after):
+        query = session.query(LogAPI).options(
+            *[defer(getattr(LogAPI, column)) for column in self.deferred])
+        filters = list(self.filters)
+        if after is not None:
+            created_at, id_log = after
+            filters.append(or_(
+                LogAPI.CREATED_AT < created_at,
+                and_(LogAPI.CREATED_AT == created_at, LogAPI.ID < id_log)
+            ))
+        if filters:
+            query = query.filter(*filters)
+        return query.order_by(LogAPI.CREATED_AT.desc(), LogAPI.ID.desc())
+
+    def __to_dict(self, row):
+        return {column: getattr(row, column) for column in self.columns}
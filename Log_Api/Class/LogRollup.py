@@ -0,0 +1,198 @@
+from sqlalchemy import text
+from .Database import Database
+from ..Models.LogAPI import LogAPI
+from ..Models.LogRollup import LogAPIRollup, LogAPIRollupState
+from ..Utils.Sketch import Sketch
+
+GRANULARITIES = ('minute', 'hour')
+STATUS_COLUMNS = ('STATUS_2XX', 'STATUS_3XX', 'STATUS_4XX', 'STATUS_5XX', 'STATUS_OTHER')
+QUANTILES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99}
+
+
+def rollup_logs(batch_size=5000, max_batches=None, settle_seconds=60, name='LOG_APIS', mode='dbw'):
+    """
+    Aggregate the LOG_APIS rows created since the last run into per-minute and
+    per-hour rollups keyed by PATH, METHOD and DOMAIN_NAME. The last processed
+    ID is kept in LOG_API_ROLLUP_STATE and locked while a batch runs, so
+    concurrent runs do not count a row twice.
+    :param batch_size:
+        Rows of LOG_APIS aggregated per transaction
+    :param max_batches:
+        Stop after this number of batches, None runs until there are no rows
+    :param settle_seconds:
+        Rows newer than this are left for the next run, they may still be
+        waiting for their response
+    :param name:
+        Name of the job in LOG_API_ROLLUP_STATE
+    :param mode:
+        Database mode
+    :return:
+        dict with the last processed ID, the aggregated rows and the updated buckets
+    """
+    result = {'last_id': None, 'rows': 0, 'buckets': 0}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        session = Database(mode).session
+        try:
+            state = session.query(LogAPIRollupState).filter_by(
+                NAME=name).with_for_update().first()
+            if state is None:
+                state = LogAPIRollupState(NAME=name, LAST_ID=0)
+                session.add(state)
+
+            rows = session.query(
+                LogAPI.ID, LogAPI.CREATED_AT, LogAPI.UPDATED_AT, LogAPI.PATH,
+                LogAPI.METHOD, LogAPI.DOMAIN_NAME, LogAPI.STATUS_CODE, LogAPI.HANDLER_MS
+            ).filter(
+                LogAPI.ID > state.LAST_ID,
+                text(f'CREATED_AT < NOW() - INTERVAL {int(settle_seconds)} SECOND')
+            ).order_by(LogAPI.ID).limit(batch_size).all()
+            if not rows:
+                session.commit()
+                break
+
+            aggregates = __aggregate(rows)
+            for key, aggregate in aggregates.items():
+                __merge(session, key, aggregate)
+            state.LAST_ID = rows[-1].ID
+            session.commit()
+
+            result['last_id'] = state.LAST_ID
+            result['rows'] += len(rows)
+            result['buckets'] += len(aggregates)
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+        batches += 1
+    return result
+
+
+def query_rollups(granularity='minute', start=None, end=None, path=None, method=None,
+                  domain_name=None, combine=False, mode='dbr'):
+    """
+    Read the rollups
+    :param granularity:
+        minute or hour
+    :param start:
+        datetime, buckets at or after it
+    :param end:
+        datetime, buckets before it
+    :param path, method, domain_name:
+        Filters of the rollup key
+    :param combine:
+        Merge the rows of each bucket into one (e.g. all the paths)
+    :return:
+        list of dicts ordered by bucket with count, status histogram,
+        error_rate and p50/p95/p99 duration in ms
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Granularidad no valida: {granularity}')
+
+    session = Database(mode).session
+    try:
+        query = session.query(LogAPIRollup).filter(LogAPIRollup.GRANULARITY == granularity)
+        if start is not None:
+            query = query.filter(LogAPIRollup.BUCKET >= start)
+        if end is not None:
+            query = query.filter(LogAPIRollup.BUCKET < end)
+        if path is not None:
+            query = query.filter(LogAPIRollup.PATH == path)
+        if method is not None:
+            query = query.filter(LogAPIRollup.METHOD == method.upper())
+        if domain_name is not None:
+            query = query.filter(LogAPIRollup.DOMAIN_NAME == domain_name)
+        rollups = query.order_by(LogAPIRollup.BUCKET).all()
+
+        grouped = {}
+        for rollup in rollups:
+            if combine:
+                key = (rollup.BUCKET, None, None, None)
+            else:
+                key = (rollup.BUCKET, rollup.PATH, rollup.METHOD, rollup.DOMAIN_NAME)
+            item = grouped.get(key)
+            if item is None:
+                item = grouped[key] = {
+                    'bucket': key[0], 'path': key[1], 'method': key[2], 'domain_name': key[3],
+                    'count': 0, 'sketch': Sketch()
+                }
+                for column in STATUS_COLUMNS:
+                    item[column.lower()] = 0
+            item['count'] += rollup.COUNT
+            for column in STATUS_COLUMNS:
+                item[column.lower()] += getattr(rollup, column)
+            item['sketch'].merge(Sketch.from_json(rollup.DURATION_SKETCH))
+    finally:
+        session.close()
+
+    items = []
+    for item in grouped.values():
+        sketch = item.pop('sketch')
+        item['error_rate'] = item['status_5xx'] / item['count'] if item['count'] else 0.0
+        for name, q in QUANTILES.items():
+            item[name] = sketch.quantile(q)
+        items.append(item)
+    return items
+
+
+def __bucket(created_at, granularity):
+    if granularity == 'minute':
+        return created_at.replace(second=0, microsecond=0)
+    return created_at.replace(minute=0, second=0, microsecond=0)
+
+
+def __duration_ms(row):
+    if row.HANDLER_MS is not None:
+        return row.HANDLER_MS
+    # Logs saved before HANDLER_MS existed: time between the insert of the
+    # request and the update with the response
+    if row.STATUS_CODE is None or row.CREATED_AT is None or row.UPDATED_AT is None:
+        return None
+    return max(0.0, (row.UPDATED_AT - row.CREATED_AT).total_seconds() * 1000)
+
+
+def __status_column(status_code):
+    if status_code is not None and 200 <= status_code < 600:
+        return f'STATUS_{status_code // 100}XX'
+    return 'STATUS_OTHER'
+
+
+def __aggregate(rows):
+    aggregates = {}
+    for row in rows:
+        if row.CREATED_AT is None:
+            continue
+        duration = __duration_ms(row)
+        for granularity in GRANULARITIES:
+            key = (granularity, __bucket(row.CREATED_AT, granularity),
+                   row.PATH, row.METHOD, row.DOMAIN_NAME or '')
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregate = aggregates[key] = dict(
+                    {column: 0 for column in STATUS_COLUMNS}, COUNT=0, sketch=Sketch())
+            aggregate['COUNT'] += 1
+            aggregate[__status_column(row.STATUS_CODE)] += 1
+            aggregate['sketch'].add(duration)
+    return aggregates
+
+
+def __merge(session, key, aggregate):
+    granularity, bucket, path, method, domain_name = key
+    rollup = session.query(LogAPIRollup).filter_by(
+        GRANULARITY=granularity, BUCKET=bucket, PATH=path,
+        METHOD=method, DOMAIN_NAME=domain_name
+    ).with_for_update().first()
+    if rollup is None:
+        rollup = LogAPIRollup(
+            GRANULARITY=granularity, BUCKET=bucket, PATH=path,
+            METHOD=method, DOMAIN_NAME=domain_name, COUNT=0,
+            **{column: 0 for column in STATUS_COLUMNS}
+        )
+        session.add(rollup)
+
+    rollup.COUNT += aggregate['COUNT']
+    for column in STATUS_COLUMNS:
+        setattr(rollup, column, getattr(rollup, column) + aggregate[column])
+    rollup.DURATION_SKETCH = Sketch.from_json(
+        rollup.DURATION_SKETCH).merge(aggregate['sketch']).to_json()
@@ -0,0 +1,189 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+
+# Back-pressure policies when the queue is full
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+SPILL = 'spill'
+
+
+class LogShipper():
+    """
+    Bounded in-process queue of log records drained by a background thread,
+    so the API response does not wait for the database.
+    """
+
+    def __init__(self, writer, max_size=1000, policy=BLOCK,
+                 block_timeout=1.0, spill=None):
+        """
+        :param writer:
+            Function called by the worker with each record
+        :param max_size:
+            Max records in the queue
+        :param policy:
+            What to do when the queue is full: block, drop_oldest or spill
+        :param block_timeout:
+            Seconds to wait for a free slot with the block policy, after
+            that the record is dropped
+        :param spill:
+            Function that saves a record when the queue is full with the
+            spill policy, or when the writer fails
+        """
+        if policy not in (BLOCK, DROP_OLDEST, SPILL):
+            raise ValueError(f'Politica de cola no valida: {policy}')
+
+        self.writer = writer
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_writer = spill
+        self.__queue = queue.Queue(maxsize=max_size)
+        self.__lock = threading.Lock()
+        self.__worker = None
+        self.__stats = {'enqueued': 0, 'written': 0, 'errors': 0,
+                        'dropped': 0, 'spilled': 0}
+
+    def put(self, record):
+        """
+        Enqueue a record
+        :param record:
+            LogAPI column values
+        :return:
+            True if the record was enqueued
+        """
+        self.__start()
+        try:
+            if self.policy == BLOCK:
+                self.__queue.put(record, timeout=self.block_timeout)
+            else:
+                self.__queue.put_nowait(record)
+        except queue.Full:
+            return self.__on_full(record)
+        self.__count('enqueued')
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Wait until the worker has written every enqueued record
+        :param timeout:
+            Max seconds to wait, None waits forever
+        :return:
+            True if the queue was drained
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        with self.__queue.all_tasks_done:
+            while self.__queue.unfinished_tasks:
+                if end is None:
+                    self.__queue.all_tasks_done.wait()
+                    continue
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.__queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stats(self):
+        """
+        Queue depth and counters of enqueued, written, dropped and spilled records
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+        stats['depth'] = self.__queue.qsize()
+        return stats
+
+    def __on_full(self, record):
+        if self.policy == DROP_OLDEST:
+            try:
+                self.__queue.get_nowait()
+                self.__queue.task_done()
+                self.__count('dropped')
+            except queue.Empty:
+                pass
+            try:
+                self.__queue.put_nowait(record)
+                self.__count('enqueued')
+                return True
+            except queue.Full:
+                self.__count('dropped')
+                return False
+
+        if self.policy == SPILL and self.spill(record):
+            return False
+
+        self.__count('dropped')
+        return False
+
+    def spill(self, record):
+        """
+        Save a record with the spill function
+        :return:
+            True if the record was spilled
+        """
+        if self.spill_writer is None:
+            return False
+        try:
+            self.spill_writer(record)
+        except Exception as e:
+            logging.error(f'Error guardando log en el spill: {e}')
+            return False
+        self.__count('spilled')
+        return True
+
+    def __count(self, name):
+        with self.__lock:
+            self.__stats[name] += 1
+
+    def __start(self):
+        if self.__worker is not None and self.__worker.is_alive():
+            return
+        with self.__lock:
+            if self.__worker is None or not self.__worker.is_alive():
+                self.__worker = threading.Thread(
+                    target=self.__run, name='log-api-shipper', daemon=True)
+                self.__worker.start()
+
+    def __run(self):
+        while True:
+            record = self.__queue.get()
+            try:
+                self.writer(record)
+                self.__count('written')
+            except Exception as e:
+                logging.error(f'Error guardando log de la api: {e}')
+                self.__count('errors')
+                self.spill(record)
+            finally:
+                self.__queue.task_done()
+
+
+__shipper = None
+__shipper_lock = threading.Lock()
+
+
+def get_shipper(writer, spill=None):
+    """
+    Get the shipper of the container, it is created on first use with the
+    LOG_API_QUEUE_SIZE, LOG_API_QUEUE_POLICY and LOG_API_QUEUE_TIMEOUT
+    environment variables
+    :param writer:
+        Function that writes a record in the database
+    :param spill:
+        Function that saves a record that could not be written
+    """
+    global __shipper
+    if __shipper is None:
+        with __shipper_lock:
+            if __shipper is None:
+                __shipper = LogShipper(
+                    writer,
+                    max_size=int(os.getenv('LOG_API_QUEUE_SIZE', 1000)),
+                    policy=os.getenv('LOG_API_QUEUE_POLICY', BLOCK),
+                    block_timeout=float(os.getenv('LOG_API_QUEUE_TIMEOUT', 1)),
+                    spill=spill
+                )
+                # Last chance to write pending records when the runtime shuts down
+                atexit.register(__shipper.flush, float(os.getenv('LOG_API_FLUSH_TIMEOUT', 2)))
+    return __shipper
@@ -0,0 +1,260 @@
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import DateTime
+from sqlalchemy.dialects.mysql import insert
+from .Database import Database
+from ..Models.LogAPI import LogAPI
+
+# Each record is a 4 bytes big-endian length followed by its JSON
+HEADER = struct.Struct('>I')
+# Columns completed by the replay if the row was already inserted
+RESPONSE_COLUMNS = ('STATUS_CODE', 'HEADERS_RESPONSE', 'BODY_RESPONSE', 'HANDLER_MS',
+                    'RESPONSE_BYTES', 'LOG_OVERHEAD_MS')
+DATETIME_COLUMNS = [column.key for column in LogAPI.__table__.columns
+                    if isinstance(column.type, DateTime)]
+
+
+class SpillBuffer():
+    """
+    Append-only file of LogAPI records used when the database is not
+    available, replayed into LOG_APIS once it is healthy again. Records are
+    idempotent through their REQUEST_ID.
+    """
+
+    def __init__(self, path='/tmp/log_api_spill.bin', fsync_every=20, fsync_interval=1.0):
+        """
+        :param path:
+            File of the buffer
+        :param fsync_every:
+            Records appended between fsyncs
+        :param fsync_interval:
+            Max seconds between fsyncs
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.__lock = threading.Lock()
+        self.__replay_lock = threading.Lock()
+        self.__replay_offset = 0
+        self.__file = None
+        self.__pending = 0
+        self.__synced_at = time.monotonic()
+        self.__stats = {'spilled': 0, 'replayed': 0, 'replay_errors': 0}
+
+    def append(self, record):
+        """
+        Append a record, it is fsynced in batches
+        :param record:
+            LogAPI column values
+        """
+        data = json.dumps(record, default=self.__default).encode('utf-8')
+        with self.__lock:
+            if self.__file is None:
+                self.__file = open(self.path, 'ab')
+            self.__file.write(HEADER.pack(len(data)) + data)
+            self.__file.flush()
+            self.__pending += 1
+            self.__stats['spilled'] += 1
+            if (self.__pending >= self.fsync_every
+                    or time.monotonic() - self.__synced_at >= self.fsync_interval):
+                self.__sync()
+
+    def sync(self):
+        """
+        fsync the appended records
+        """
+        with self.__lock:
+            self.__sync()
+
+    def pending(self):
+        """
+        True if there are records waiting to be replayed
+        """
+        return any(os.path.exists(path) and os.path.getsize(path) > 0
+                   for path in (self.path, self.__replay_path))
+
+    def records(self, path=None):
+        """
+        Read the records of the file, a truncated last record is ignored
+        :return:
+            generator of dicts
+        """
+        for record, _ in self.__entries(path or self.path):
+            yield record
+
+    def replay(self, batch_size=500, mode='dbw', max_batches=None, fail_fast=False):
+        """
+        Insert the spilled records in LOG_APIS. The file is moved aside while
+        it is replayed and removed when every record was inserted; rows whose
+        REQUEST_ID already exists only get their response columns updated.
+        The offset of the inserted batches is kept, so a bounded or failed
+        replay continues where it stopped. Only one replay runs at a time, a
+        concurrent call returns without replaying.
+        :param max_batches:
+            Max batches inserted by this call, None to replay the whole file
+        :param fail_fast:
+            True to insert with the engine of the log writes (tight timeouts)
+        :return:
+            dict with the replayed records and if the file was completed
+        """
+        if not self.__replay_lock.acquire(blocking=False):
+            return {'replayed': 0, 'done': False}
+        try:
+            return self.__replay(batch_size, mode, max_batches, fail_fast)
+        finally:
+            self.__replay_lock.release()
+
+    def stats(self):
+        with self.__lock:
+            return dict(self.__stats)
+
+    @property
+    def __replay_path(self):
+        return f'{self.path}.replaying'
+
+    def __replay(self, batch_size, mode, max_batches, fail_fast):
+        with self.__lock:
+            self.__sync()
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+            # A previous replay that failed or was bounded is continued first
+            if not os.path.exists(self.__replay_path) and os.path.exists(self.path):
+                os.replace(self.path, self.__replay_path)
+                self.__replay_offset = 0
+
+        replayed = 0
+        batches = 0
+        done = True
+        entries = self.__entries(self.__replay_path, self.__replay_offset)
+        try:
+            batch = []
+            offset = self.__replay_offset
+            for record, end in entries:
+                if max_batches is not None and batches >= max_batches:
+                    done = False
+                    break
+                batch.append(record)
+                offset = end
+                if len(batch) >= batch_size:
+                    replayed += self.__insert(batch, mode, fail_fast)
+                    self.__replay_offset = offset
+                    batches += 1
+                    batch = []
+            if batch:
+                replayed += self.__insert(batch, mode, fail_fast)
+                self.__replay_offset = offset
+        except Exception as e:
+            with self.__lock:
+                self.__stats['replay_errors'] += 1
+            raise e
+        finally:
+            entries.close()
+            with self.__lock:
+                self.__stats['replayed'] += replayed
+
+        if done:
+            if os.path.exists(self.__replay_path):
+                os.remove(self.__replay_path)
+            self.__replay_offset = 0
+        return {'replayed': replayed, 'done': done}
+
+    def __entries(self, path, offset=0):
+        """
+        Read the records of the file from `offset`
+        :return:
+            generator of (dict, offset after the record)
+        """
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        with open(path, 'rb') as spill_file:
+            with mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while offset + HEADER.size <= len(data):
+                    size, = HEADER.unpack_from(data, offset)
+                    start = offset + HEADER.size
+                    if start + size > len(data):
+                        logging.warning(f'Registro incompleto en {path}')
+                        break
+                    record = json.loads(data[start:start + size].decode('utf-8'))
+                    for column in DATETIME_COLUMNS:
+                        if record.get(column):
+                            record[column] = datetime.fromisoformat(record[column])
+                    offset = start + size
+                    yield record, offset
+
+    def __sync(self):
+        if self.__file is not None and self.__pending:
+            os.fsync(self.__file.fileno())
+        self.__pending = 0
+        self.__synced_at = time.monotonic()
+
+    @staticmethod
+    def __default(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
+
+    @staticmethod
+    def __insert(records, mode, fail_fast=False):
+        # A later record of the same REQUEST_ID completes the earlier one
+        merged = {}
+        for record in records:
+            merged.setdefault(record.get('REQUEST_ID') or id(record), {}).update(record)
+
+        session = Database(mode, fail_fast).session
+        try:
+            # On a partitioned table the REQUEST_ID key includes CREATED_AT, the
+            # stored value is reused so the upsert matches the row already inserted
+            request_ids = [request_id for request_id in merged if isinstance(request_id, str)]
+            if request_ids:
+                stored = session.query(LogAPI.REQUEST_ID, LogAPI.CREATED_AT).filter(
+                    LogAPI.REQUEST_ID.in_(request_ids))
+                for request_id, created_at in stored:
+                    if created_at is not None:
+                        merged[request_id]['CREATED_AT'] = created_at
+
+            # Columns missing in a record keep their server default
+            groups = {}
+            for record in merged.values():
+                groups.setdefault(tuple(sorted(record)), []).append(record)
+            for columns, values in groups.items():
+                statement = insert(LogAPI.__table__).values(values)
+                statement = statement.on_duplicate_key_update({
+                    column: statement.inserted[column] for column in RESPONSE_COLUMNS
+                    if column in columns
+                } or {'REQUEST_ID': statement.inserted['REQUEST_ID']})
+                session.execute(statement)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            Database.handle_auth_failure(mode, e)
+            raise e
+        finally:
+            session.close()
+        return len(records)
+
+
+__spill_buffer = None
+__spill_lock = threading.Lock()
+
+
+def get_spill_buffer():
+    """
+    Get the spill buffer of the container, configured with LOG_API_SPILL_PATH
+    and LOG_API_SPILL_FSYNC_EVERY
+    """
+    global __spill_buffer
+    if __spill_buffer is None:
+        with __spill_lock:
+            if __spill_buffer is None:
+                __spill_buffer = SpillBuffer(
+                    path=os.getenv('LOG_API_SPILL_PATH', '/tmp/log_api_spill.bin'),
+                    fsync_every=int(os.getenv('LOG_API_SPILL_FSYNC_EVERY', 20))
+                )
+    return __spill_buffer
@@ -1,2 +1,6 @@
-from .Database import Database
-from .LogAPI import log_resquest_response
\ No newline at end of file
+from .Database import Database, EngineRegistry
+from .LogAPI import log_resquest_response, async_log_resquest_response
+from .LogBatchWriter import LogBatchWriter
+from .LogPolicy import LogPolicy
+from .LogQuery import LogQuery
+from .Idempotency import MemoryIdempotencyStore, DatabaseIdempotencyStore, DynamoDBIdempotencyStore
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, String, Text, DateTime, TIMESTAMP, Index, sql
+from .LogAPI import Base
+
+
+class IdempotencyKey(Base):
+    __tablename__ = 'IDEMPOTENCY_KEYS'
+    __table_args__ = (
+        Index('IX_IDEMPOTENCY_KEYS_EXPIRES_AT', 'EXPIRES_AT'),
+    )
+    KEY = Column(String(191), primary_key=True, comment='Llave de la solicitud')
+    STATUS = Column(String(12), nullable=False, comment='in_progress o completed')
+    RESPONSE = Column(Text, nullable=True, comment='Respuesta original (JSON)')
+    EXPIRES_AT = Column(DateTime, nullable=False,
+                        comment='Fecha desde la que la llave se puede reutilizar')
+    CREATED_AT = Column(TIMESTAMP, nullable=False,
+                        server_default=sql.func.now())
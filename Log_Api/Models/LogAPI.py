@@ -1,13 +1,23 @@
-from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, sql
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, DateTime, Float, Boolean, Index, sql
 from sqlalchemy.ext.declarative import declarative_base
+from .Types import CompressedText
 
 Base = declarative_base()
 
 
 class LogAPI(Base):
     __tablename__ = 'LOG_APIS'
+    __table_args__ = (
+        Index('IX_LOG_APIS_CREATED_AT', 'CREATED_AT'),
+        Index('IX_LOG_APIS_PATH_STATUS_CODE', 'PATH', 'STATUS_CODE'),
+        Index('IX_LOG_APIS_USERNAME_CREATED_AT', 'USERNAME', 'CREATED_AT'),
+        Index('IX_LOG_APIS_REQUEST_TIME', 'REQUEST_TIME'),
+        Index('UQ_LOG_APIS_REQUEST_ID', 'REQUEST_ID', unique=True),
+    )
     ID = Column(Integer, primary_key=True,
                 autoincrement=True, comment='Id del registro')
+    REQUEST_ID = Column(String(36), nullable=True,
+                        comment='Id generado por el cliente para reenvios idempotentes')
     USERNAME = Column(String, nullable=True,
                       comment='Nombre del usuario que consume el servicio')
     PATH = Column(String, nullable=False, comment='Ruta de la api')
@@ -16,22 +26,34 @@ class LogAPI(Base):
     STATUS_CODE = Column(Integer, nullable=True,
                          comment='Codigo de estado de la respuesta')
     HEADERS_RESPONSE = Column(Text, nullable=True, comment='Cabecera de la respuesta')
-    BODY_RESPONSE = Column(Text, nullable=True,
+    BODY_RESPONSE = Column(CompressedText, nullable=True,
                            comment='Payload de la respuesta')
-    HEADERS = Column(Text, nullable=False, comment='Cabecera de la solicitud')
-    BODY = Column(Text, nullable=True, comment='Payload de la solicitud')
+    HEADERS = Column(CompressedText, nullable=False, comment='Cabecera de la solicitud')
+    BODY = Column(CompressedText, nullable=True, comment='Payload de la solicitud')
     QUERY_STR_PARAMETERS = Column(
         Text, nullable=True, comment='Query string parameters')
     PATH_PARAMETERS = Column(Text, nullable=True, comment='Path parameters')
     COOKIES = Column(Text, nullable=True)
     RAW_QUERY_STR = Column(Text, nullable=True)
-    REQUEST_CONTEXT = Column(Text, nullable=True)
+    REQUEST_CONTEXT = Column(CompressedText, nullable=True)
     AWS_CONTEXT = Column(Text, nullable=True)
     IP = Column(String, nullable=False, comment='Ip del cliente')
     USER_AGENT = Column(Text, nullable=True, comment='User agent del cliente')
     VERSION = Column(String, nullable=True, comment='Version de la respuesta')
     TIME = Column(String, nullable=True,
                   comment='Fecha en la que se ejecuto la api')
+    REQUEST_TIME = Column(DateTime, nullable=True,
+                          comment='Fecha UTC de la solicitud (requestContext.time)')
+    HANDLER_MS = Column(Float, nullable=True,
+                        comment='Duracion del handler en milisegundos')
+    REQUEST_BYTES = Column(Integer, nullable=True,
+                           comment='Tamano del body de la solicitud')
+    RESPONSE_BYTES = Column(Integer, nullable=True,
+                            comment='Tamano del body de la respuesta')
+    LOG_OVERHEAD_MS = Column(Float, nullable=True,
+                             comment='Tiempo del log antes de la ultima escritura en milisegundos')
+    COLD_START = Column(Boolean, nullable=True,
+                        comment='Primera invocacion del contenedor')
     CREATED_AT = Column(TIMESTAMP, nullable=True,
                         server_default=sql.func.now())
     UPDATED_AT = Column(TIMESTAMP, nullable=False,
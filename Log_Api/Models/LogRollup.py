@@ -0,0 +1,39 @@
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, TIMESTAMP, UniqueConstraint, sql
+from .LogAPI import Base
+
+
+class LogAPIRollup(Base):
+    __tablename__ = 'LOG_API_ROLLUPS'
+    __table_args__ = (
+        UniqueConstraint('GRANULARITY', 'BUCKET', 'PATH', 'METHOD', 'DOMAIN_NAME',
+                         name='UQ_LOG_API_ROLLUPS_BUCKET'),
+    )
+    ID = Column(BigInteger, primary_key=True,
+                autoincrement=True, comment='Id del registro')
+    GRANULARITY = Column(String(6), nullable=False, comment='minute o hour')
+    BUCKET = Column(DateTime, nullable=False, comment='Inicio del intervalo')
+    PATH = Column(String(50), nullable=False, comment='Ruta de la api')
+    METHOD = Column(String(10), nullable=False, comment='Metodo de solicitud')
+    DOMAIN_NAME = Column(String(200), nullable=False, server_default='',
+                         comment='Host de la api')
+    COUNT = Column(Integer, nullable=False, server_default='0',
+                   comment='Cantidad de solicitudes')
+    STATUS_2XX = Column(Integer, nullable=False, server_default='0')
+    STATUS_3XX = Column(Integer, nullable=False, server_default='0')
+    STATUS_4XX = Column(Integer, nullable=False, server_default='0')
+    STATUS_5XX = Column(Integer, nullable=False, server_default='0')
+    STATUS_OTHER = Column(Integer, nullable=False, server_default='0',
+                          comment='Sin respuesta u otro codigo')
+    DURATION_SKETCH = Column(Text, nullable=True,
+                             comment='Sketch de la duracion en ms (JSON)')
+    UPDATED_AT = Column(TIMESTAMP, nullable=False,
+                        server_default=sql.func.now())
+
+
+class LogAPIRollupState(Base):
+    __tablename__ = 'LOG_API_ROLLUP_STATE'
+    NAME = Column(String(50), primary_key=True, comment='Nombre del job')
+    LAST_ID = Column(BigInteger, nullable=False, server_default='0',
+                     comment='Ultimo ID de LOG_APIS procesado')
+    UPDATED_AT = Column(TIMESTAMP, nullable=False,
+                        server_default=sql.func.now())
@@ -0,0 +1,78 @@
+import os
+import zlib
+import base64
+from sqlalchemy import Text
+from sqlalchemy.types import TypeDecorator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Header char of each storage format, raw JSON never starts with them
+ZLIB = '\x01'
+ZSTD = '\x02'
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text column compressed above a size threshold. The stored value is a
+    header char with the codec followed by the compressed payload in base64,
+    so the column keeps its Text type and uncompressed rows are still read.
+    Compression is enabled with LOG_API_COMPRESSION=zlib|zstd and applies
+    to values of at least LOG_API_COMPRESSION_THRESHOLD bytes.
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return self.compress(value)
+
+    def process_result_value(self, value, dialect):
+        return self.decompress(value)
+
+    @classmethod
+    def codec(cls):
+        codec = os.getenv('LOG_API_COMPRESSION', '').lower()
+        if codec == 'zstd' and zstandard is not None:
+            return ZSTD
+        if codec in ('zlib', 'zstd'):
+            return ZLIB
+        return None
+
+    @classmethod
+    def is_compressed(cls, value):
+        return isinstance(value, str) and value[:1] in (ZLIB, ZSTD)
+
+    @classmethod
+    def compress(cls, value):
+        """
+        Compress the value if compression is enabled and it is above the threshold
+        """
+        codec = cls.codec()
+        if codec is None or value is None or cls.is_compressed(value):
+            return value
+        data = value.encode('utf-8')
+        if len(data) < int(os.getenv('LOG_API_COMPRESSION_THRESHOLD', 1024)):
+            return value
+        if codec == ZSTD:
+            data = zstandard.ZstdCompressor().compress(data)
+        else:
+            data = zlib.compress(data)
+        return codec + base64.b64encode(data).decode('ascii')
+
+    @classmethod
+    def decompress(cls, value):
+        """
+        Get the original text of a stored value
+        """
+        if not cls.is_compressed(value):
+            return value
+        data = base64.b64decode(value[1:])
+        if value[0] == ZSTD:
+            if zstandard is None:
+                raise ValueError('zstandard no esta instalado')
+            data = zstandard.ZstdDecompressor().decompress(data)
+        else:
+            data = zlib.decompress(data)
+        return data.decode('utf-8')
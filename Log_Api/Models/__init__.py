@@ -1 +1,4 @@
-from .LogAPI import LogAPI
\ No newline at end of file
+from .LogAPI import LogAPI
+from .Types import CompressedText
+from .LogRollup import LogAPIRollup, LogAPIRollupState
+from .Idempotency import IdempotencyKey
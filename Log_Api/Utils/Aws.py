@@ -1,27 +1,95 @@
 import os
+import copy
+import time
 import json
 import boto3
 import base64
 import logging
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import NoCredentialsError
 from botocore.exceptions import ClientError
 
+from .Cache import TTLCache
+
+# Cache de secretos compartido por el contenedor
+secret_cache = TTLCache(
+    ttl=float(os.getenv('SECRET_CACHE_TTL', 300)),
+    max_size=int(os.getenv('SECRET_CACHE_SIZE', 64)),
+    stale_ttl=float(os.getenv('SECRET_CACHE_STALE_TTL', 600))
+)
+
+# Configuracion de botocore para todos los clientes
+CLIENT_CONFIG = {
+    'max_pool_connections': int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 10)),
+    'connect_timeout': float(os.getenv('AWS_CONNECT_TIMEOUT', 5)),
+    'retries': {
+        'max_attempts': int(os.getenv('AWS_MAX_ATTEMPTS', 3)),
+        'mode': os.getenv('AWS_RETRY_MODE', 'standard')
+    }
+}
+# Sin AWS_READ_TIMEOUT se usa el de botocore (60 s), las lambdas sincronas pueden tardar
+if os.getenv('AWS_READ_TIMEOUT'):
+    CLIENT_CONFIG['read_timeout'] = float(os.getenv('AWS_READ_TIMEOUT'))
+
+# Configuracion de las transferencias de S3 (multipart y concurrencia)
+MB = 1024 * 1024
+TRANSFER_CONFIG = {
+    'multipart_threshold': int(os.getenv('S3_MULTIPART_THRESHOLD', 8 * MB)),
+    'multipart_chunksize': int(os.getenv('S3_MULTIPART_CHUNKSIZE', 8 * MB)),
+    'max_concurrency': int(os.getenv('S3_MAX_CONCURRENCY', 10)),
+    'use_threads': os.getenv('S3_USE_THREADS', 'true').lower() == 'true'
+}
+
+# Llaves de S3 por prefijo para validar existencia de archivos
+key_index_cache = TTLCache(
+    ttl=float(os.getenv('S3_KEY_INDEX_TTL', 60)),
+    max_size=int(os.getenv('S3_KEY_INDEX_SIZE', 16))
+)
+
+# Clientes de aws compartidos por el contenedor
+_clients = {}
+_clients_lock = threading.Lock()
+
 class Aws:
 
     def __init__(self, secret_name: str):
         self.__secret_name = secret_name
-    
-    def get_secret(self):
+
+    @property
+    def secret_id(self):
+        return f"{os.getenv('STAGE')}/{self.__secret_name}"
+
+    def get_secret(self, refresh: bool = False):
         """
-        Obtener secreto
-        param: str
-            name llave del nombre del secreto a obtener
+        Obtener secreto, se mantiene en cache durante SECRET_CACHE_TTL segundos
+        param: refresh
+            ignorar el cache y consultar Secrets Manager
         """
-        stage = os.getenv('STAGE')
+        secret_name = self.secret_id
+        if refresh:
+            secret_cache.invalidate(secret_name)
+        return secret_cache.get(
+            secret_name, lambda: self.__fetch_secret(secret_name))
 
-        secret_name = f'{stage}/{self.__secret_name}'
+    def invalidate_secret(self):
+        """
+        Eliminar el secreto del cache, por ejemplo cuando la base de datos
+        rechaza las credenciales despues de una rotacion
+        """
+        secret_cache.invalidate(self.secret_id)
+
+    @classmethod
+    def secret_cache_stats(cls):
+        """
+        Contadores de hits y misses del cache de secretos
+        """
+        return secret_cache.stats()
 
+    def __fetch_secret(self, secret_name: str):
         client = self.get_client('secretsmanager')
 
         try:
@@ -49,9 +117,10 @@ class Aws:
         return json.loads(secret)
 
     @classmethod
-    def get_client(cls, service_name: str, credentials: dict = {}):
+    def get_client(cls, service_name: str, credentials: dict = {}, config: dict = None):
         """
-        Obtener cliente de aws
+        Obtener cliente de aws, los clientes se reutilizan en el contenedor
+        por servicio, region, credenciales y configuracion
         param: service_name
             nombre del servicio
         param: credentials
@@ -60,20 +129,56 @@ class Aws:
                     access key de aws
                 secret_acces_key (str): 
                     secret access key de aws
+        param: config
+            opciones de botocore Config que reemplazan las de CLIENT_CONFIG (opcional)
         return: client
             cliente de aws
         """
-        session = boto3.session.Session()
-        
-        client = session.client(
-            service_name=service_name,
-            region_name=os.getenv('REGION'),
-            aws_access_key_id=credentials.get('accessKey', None),
-            aws_secret_access_key=credentials.get('secretKey', None),
-        )
+        region_name = os.getenv('REGION')
+        access_key = credentials.get('accessKey', None)
+        options = dict(CLIENT_CONFIG, **(config or {}))
+        key = (service_name, region_name, access_key,
+               tuple(sorted((k, repr(v)) for k, v in options.items())))
+
+        client = _clients.get(key)
+        if client is not None:
+            return client
 
+        # boto3.session.Session no es thread-safe, los clientes si
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                session = boto3.session.Session()
+                client = session.client(
+                    service_name=service_name,
+                    region_name=region_name,
+                    aws_access_key_id=access_key,
+                    aws_secret_access_key=credentials.get('secretKey', None),
+                    # Config modifica el dict de retries, no debe cambiar la llave
+                    config=Config(**copy.deepcopy(options))
+                )
+                _clients[key] = client
         return client
 
+    @staticmethod
+    def __pool_size(workers: int) -> int:
+        """
+        Conexiones del pool para `workers` hilos, redondeadas a una potencia de
+        2 para limitar los clientes distintos en cache
+        """
+        size = max(CLIENT_CONFIG['max_pool_connections'], 1)
+        while size < workers:
+            size *= 2
+        return size
+
+    @classmethod
+    def clear_clients(cls):
+        """
+        Eliminar los clientes en cache
+        """
+        with _clients_lock:
+            _clients.clear()
+
     @classmethod
     def lambdaInvoke(cls, function_name: str, data: dict, inv_type: str = 'RequestResponse') -> dict:
         """
@@ -86,11 +191,14 @@ class Aws:
         Returns:
             response (dict): Respuesta de la función lambda
         """
+        return cls.__invoke(cls.get_client('lambda'), function_name, data, inv_type)
+
+    @classmethod
+    def __invoke(cls, client, function_name: str, data: dict, inv_type: str):
         # if inv_type == 'RequestResponse':
         #     data = {'body': json.dumps(data)}
         data = {'body': json.dumps(data)}
         data = json.dumps(data)
-        client = cls.get_client('lambda')
         response = client.invoke(
             FunctionName=function_name,
             Payload=data,
@@ -102,6 +210,101 @@ class Aws:
             response = cls.get_data_from_response(response)
         return response
 
+    @classmethod
+    def lambda_invoke_many(cls, calls: list, max_workers: int = 10, timeout: float = None,
+                           inv_type: str = 'RequestResponse') -> list:
+        """
+        Invocar varias lambdas en paralelo con un cliente compartido
+        Args:
+            calls (list): tuplas (function_name, data)
+            max_workers (int): invocaciones simultaneas maximas
+            timeout (float): segundos maximos de espera de cada invocacion
+            inv_type (str): Tipo de invocación de las funciones lambda
+
+        Returns:
+            results (list): un dict por invocación, en el orden de calls, con
+                index, function_name, ok, data (respuesta) y error
+        """
+        results = [None] * len(calls)
+        for result in cls.lambda_invoke_as_completed(calls, max_workers, timeout, inv_type):
+            results[result['index']] = result
+        return results
+
+    @classmethod
+    def lambda_invoke_as_completed(cls, calls: list, max_workers: int = 10, timeout: float = None,
+                                   inv_type: str = 'RequestResponse'):
+        """
+        Invocar varias lambdas en paralelo y retornar cada resultado apenas termina
+        Args:
+            calls (list): tuplas (function_name, data)
+            max_workers (int): invocaciones simultaneas maximas
+            timeout (float): segundos maximos de espera de cada invocacion,
+                contados desde que empieza; sin reintentos para no invocar
+                de nuevo una lambda lenta. Al vencer se retorna como fallida
+            inv_type (str): Tipo de invocación de las funciones lambda
+
+        Returns:
+            generador de dicts con index, function_name, ok, data y error
+        """
+        # La config es parte de la llave del cache de clientes: el timeout se
+        # controla en los futures y el pool se redondea, asi se comparten
+        config = {'max_pool_connections': cls.__pool_size(max_workers)}
+        if timeout is not None:
+            # Un reintento invocaria de nuevo una lambda lenta
+            config['retries'] = {'total_max_attempts': 1,
+                                 'mode': CLIENT_CONFIG['retries']['mode']}
+        client = cls.get_client('lambda', config=config)
+
+        started = {}
+
+        def invoke(index, function_name, data):
+            started[index] = time.monotonic()
+            return cls.__invoke(client, function_name, data, inv_type)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {
+            executor.submit(invoke, index, function_name, data): (index, function_name)
+            for index, (function_name, data) in enumerate(calls)
+        }
+        pending = set(futures)
+        try:
+            while pending:
+                wait_timeout = None
+                if timeout is not None:
+                    deadlines = [started[futures[future][0]] + timeout for future in pending
+                                 if futures[future][0] in started]
+                    wait_timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else timeout
+                done, _ = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    pending.discard(future)
+                    index, function_name = futures[future]
+                    result = {'index': index, 'function_name': function_name,
+                              'ok': True, 'data': None, 'error': None}
+                    try:
+                        result['data'] = future.result()
+                    except Exception as e:
+                        logging.error(f'Error invocando {function_name}: {e}')
+                        result['ok'] = False
+                        result['error'] = str(e)
+                    yield result
+
+                if timeout is None:
+                    continue
+                now = time.monotonic()
+                for future in [future for future in pending if futures[future][0] in started
+                               and now - started[futures[future][0]] >= timeout]:
+                    pending.discard(future)
+                    index, function_name = futures[future]
+                    logging.error(f'Timeout invocando {function_name} ({timeout} s)')
+                    yield {'index': index, 'function_name': function_name, 'ok': False,
+                           'data': None, 'error': f'Timeout de {timeout} s'}
+        finally:
+            # Las invocaciones vencidas no se esperan, las no iniciadas se cancelan
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
     @classmethod
     def get_data_from_response(cls, response):
         """
@@ -153,10 +356,12 @@ class Aws:
         bucket_name = secrets["bucket_name"]
 
 
-        s3_client = boto3.client('s3')
+        s3_client = self.get_client('s3')
 
         try:
-            s3_client.upload_file(file_path, bucket_name, file_name)
+            s3_client.upload_file(file_path, bucket_name, file_name,
+                                  Config=self.transfer_config())
+            self.__invalidate_key_index()
         except FileNotFoundError:
             raise ValueError("Error al guardar el archivo")
         except NoCredentialsError:
@@ -178,10 +383,11 @@ class Aws:
         bucket_name = secrets["bucket_name"]
         
         # Put object to bucket
-        s3_client = boto3.client('s3')
+        s3_client = self.get_client('s3')
 
         try:
             s3_client.delete_object(Bucket=bucket_name, Key=file_path)
+            self.__invalidate_key_index()
         except FileNotFoundError:
             raise ValueError("Error al eliminar el archivo")
         except NoCredentialsError:
@@ -204,9 +410,11 @@ class Aws:
 
             bucket_name = secrets["bucket_name"]
 
-            s3_client = boto3.client('s3')
+            s3_client = self.get_client('s3')
             with open(file_route, 'rb') as file:
-                s3_client.upload_fileobj(file, bucket_name, filename)
+                s3_client.upload_fileobj(file, bucket_name, filename,
+                                         Config=self.transfer_config())
+            self.__invalidate_key_index()
         except FileNotFoundError:
             raise ValueError("Error al guardar el archivo")
         except NoCredentialsError:
@@ -214,6 +422,129 @@ class Aws:
         except Exception as e:
             raise e
     
+    @classmethod
+    def transfer_config(cls, **options):
+        """
+        Configuracion de transferencias de S3
+        :param: options
+            opciones de TransferConfig que reemplazan las de TRANSFER_CONFIG
+            (multipart_threshold, multipart_chunksize, max_concurrency, use_threads)
+        :return: TransferConfig
+        """
+        return TransferConfig(**dict(TRANSFER_CONFIG, **options))
+
+    def upload_many(self, files: list, max_workers: int = 10) -> list:
+        """
+        Subir varios archivos a S3 en paralelo
+        :param: files
+            tuplas (file_path, file_name), file_name con esta estructura:
+                carpeta/nombre_archivo.extension
+        :param: max_workers
+            subidas simultaneas maximas
+        :return: lista de dicts con file_name, ok y error, en el orden de files
+        """
+        bucket_name = self.get_secret()["bucket_name"]
+        s3_client = self.get_client(
+            's3', config={'max_pool_connections': self.__pool_size(max_workers * 2)})
+        # Cada archivo se sube en un hilo, sus partes sin hilos adicionales
+        config = self.transfer_config(use_threads=False)
+
+        def upload(file_path, file_name):
+            try:
+                s3_client.upload_file(file_path, bucket_name, file_name, Config=config)
+                return {'file_name': file_name, 'ok': True, 'error': None}
+            except Exception as e:
+                logging.error(f'Error subiendo {file_name}: {e}')
+                return {'file_name': file_name, 'ok': False, 'error': str(e)}
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(lambda file: upload(*file), files))
+        finally:
+            self.__invalidate_key_index()
+
+    def delete_many(self, file_paths: list) -> dict:
+        """
+        Eliminar varios archivos de S3 con delete_objects (1000 por solicitud)
+        :param: file_paths
+            rutas de los archivos, con esta estructura:
+                carpeta/nombre_archivo.extension
+        :return: dict con deleted (rutas eliminadas) y errors (ruta y mensaje)
+        """
+        bucket_name = self.get_secret()["bucket_name"]
+        s3_client = self.get_client('s3')
+        result = {'deleted': [], 'errors': []}
+        for start in range(0, len(file_paths), 1000):
+            response = s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={
+                    'Objects': [{'Key': key} for key in file_paths[start:start + 1000]],
+                    'Quiet': False
+                }
+            )
+            result['deleted'] += [deleted['Key'] for deleted in response.get('Deleted', [])]
+            result['errors'] += [
+                {'file_path': error['Key'], 'error': error.get('Message')}
+                for error in response.get('Errors', [])
+            ]
+        self.__invalidate_key_index()
+        return result
+
+    @classmethod
+    def stream_object(cls, bucket_name: str, object_name: str, chunk_size: int = MB,
+                      start: int = None, end: int = None):
+        """
+        Descargar un objeto de S3 por partes, sin cargarlo completo en memoria
+        :param: bucket_name
+            nombre del bucket
+        :param: object_name
+            ruta del objeto
+        :param: chunk_size
+            bytes de cada parte
+        :param: start, end
+            rango de bytes a descargar, incluyendo end (opcional)
+        :return: generador de bytes
+        """
+        params = {'Bucket': bucket_name, 'Key': object_name}
+        if start is not None or end is not None:
+            params['Range'] = f"bytes={start or 0}-{'' if end is None else end}"
+        s3_object = cls.get_client('s3').get_object(**params)
+        try:
+            for chunk in s3_object['Body'].iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            s3_object['Body'].close()
+
+    @classmethod
+    def get_object_range(cls, bucket_name: str, object_name: str, start: int, end: int):
+        """
+        Obtener un rango de bytes de un objeto de S3
+        :param: start, end
+            posicion del primer y ultimo byte (incluido)
+        :return: bytes del rango. If error, returns None.
+        """
+        try:
+            return b''.join(cls.stream_object(bucket_name, object_name, start=start, end=end))
+        except ClientError as e:
+            logging.error(e)
+            return None
+
+    @classmethod
+    def download_to_file(cls, bucket_name: str, object_name: str, file_path: str):
+        """
+        Descargar un objeto de S3 a un archivo, por partes y en paralelo
+        :param: file_path
+            ruta local del archivo, por ejemplo en /tmp
+        """
+        try:
+            cls.get_client('s3').download_file(
+                bucket_name, object_name, file_path, Config=cls.transfer_config())
+        except NoCredentialsError:
+            raise ValueError("Credenciales invalidas")
+        except ClientError as e:
+            logging.error(e)
+            raise ValueError("Error al descargar el archivo")
+
     @classmethod
     def get_object(cls, bucket_name: str, object_name: str):
         """Get an object from an S3 bucket
@@ -224,7 +555,7 @@ class Aws:
         """
 
         # Generate a presigned URL for the S3 object
-        s3_client = boto3.client('s3')
+        s3_client = cls.get_client('s3')
         try:
             s3_object = s3_client.get_object(Bucket=bucket_name, Key=object_name)
             response = s3_object['Body'].read()
@@ -248,7 +579,7 @@ class Aws:
         bucket_name = secrets["bucket_name"]
         
         # Generate a presigned URL for the S3 object
-        s3_client = boto3.client('s3')
+        s3_client = self.get_client('s3')
         try:
             file_valid = True
             try:
@@ -273,3 +604,111 @@ class Aws:
 
         # The response contains the presigned URL
         return response
+
+    def create_presigned_urls(self, object_names: list, expiration=7257600,
+                              check_exists: bool = False, prefix: str = None) -> dict:
+        """Generate presigned URLs for many S3 objects
+
+        Signing is local, the only network call is the optional existence
+        check: the keys are grouped by folder and each folder is scanned once
+        with list_objects_v2, its keys kept in cache for S3_KEY_INDEX_TTL
+        seconds. Keys missing from a cached scan, and keys outside a folder
+        (the scan would be the whole bucket), are checked with head_object.
+
+        :param object_names: list of keys
+        :param expiration: Time in seconds for the presigned URLs to remain valid
+        :param check_exists: return None for the keys that do not exist
+        :param prefix: prefix scanned for the existence check of every key,
+            defaults to the folder of each key
+        :return: dict of key to presigned URL (None if it does not exist)
+        """
+        bucket_name = self.get_secret()["bucket_name"]
+        s3_client = self.get_client('s3')
+
+        existing = None
+        if check_exists and object_names:
+            try:
+                existing = self.__existing_keys(s3_client, bucket_name, list(object_names), prefix)
+            except ClientError as e:
+                logging.error(e)
+                return {object_name: None for object_name in object_names}
+
+        urls = {}
+        for object_name in object_names:
+            if existing is not None and object_name not in existing:
+                urls[object_name] = None
+                continue
+            urls[object_name] = s3_client.generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': bucket_name,
+                    'Key': object_name},
+                ExpiresIn=expiration)
+        return urls
+
+    def __existing_keys(self, s3_client, bucket_name: str, object_names: list,
+                        prefix: str = None) -> set:
+        """
+        Llaves de object_names que existen en el bucket
+        """
+        if prefix is not None:
+            groups = {prefix: object_names}
+        else:
+            groups = {}
+            for object_name in object_names:
+                folder = object_name.rpartition('/')[0]
+                groups.setdefault(f'{folder}/' if folder else '', []).append(object_name)
+
+        existing, unchecked = set(), []
+        for group_prefix, names in groups.items():
+            if not group_prefix:
+                # Sin carpeta se listaria el bucket completo
+                unchecked.extend(names)
+                continue
+            listed = []
+
+            def load(group_prefix=group_prefix):
+                listed.append(True)
+                return self.list_keys(bucket_name, group_prefix)
+
+            keys = key_index_cache.get((bucket_name, group_prefix), load)
+            for name in names:
+                if name in keys:
+                    existing.add(name)
+                elif not listed:
+                    # Otro contenedor pudo subirla despues del listado en cache
+                    unchecked.append(name)
+
+        def head(object_name):
+            try:
+                s3_client.head_object(Bucket=bucket_name, Key=object_name)
+                return True
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                    return False
+                raise e
+
+        if len(unchecked) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(unchecked), 10)) as executor:
+                found = list(executor.map(head, unchecked))
+        else:
+            found = [head(object_name) for object_name in unchecked]
+        existing.update(name for name, exists in zip(unchecked, found) if exists)
+        return existing
+
+    @staticmethod
+    def __invalidate_key_index():
+        # Las llaves en cache ya no corresponden al bucket, se listan de nuevo
+        key_index_cache.invalidate()
+
+    @classmethod
+    def list_keys(cls, bucket_name: str, prefix: str = '') -> set:
+        """
+        Obtener las llaves de un bucket que empiezan por prefix
+        :return: set de llaves
+        """
+        keys = set()
+        paginator = cls.get_client('s3').get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            keys.update(item['Key'] for item in page.get('Contents', []))
+        return keys
@@ -0,0 +1,115 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Cache en memoria con tiempo de vida (TTL) y desalojo LRU.
+    Los valores vencidos dentro de la ventana `stale_ttl` se retornan
+    mientras se refrescan en segundo plano (stale-while-revalidate).
+    """
+
+    def __init__(self, ttl: float = 300, max_size: int = 128, stale_ttl: float = 0):
+        """
+        :param: ttl
+            segundos en los que un valor se considera fresco
+        :param: max_size
+            cantidad maxima de llaves, se desaloja la menos usada
+        :param: stale_ttl
+            segundos adicionales en los que se retorna el valor vencido
+            mientras se refresca en segundo plano
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stale_ttl = stale_ttl
+        self.__data = OrderedDict()
+        self.__lock = threading.RLock()
+        self.__refreshing = set()
+        self.__stats = {'hits': 0, 'stale_hits': 0, 'misses': 0,
+                        'refreshes': 0, 'refresh_errors': 0,
+                        'evictions': 0, 'invalidations': 0}
+
+    def get(self, key, loader=None, default=None):
+        """
+        Obtener un valor del cache
+        :param: key
+            llave del valor
+        :param: loader
+            funcion sin parametros que carga el valor si no esta en cache
+        :return: valor en cache, el cargado o default
+        """
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__data.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                age = now - loaded_at
+                if age < self.ttl:
+                    self.__data.move_to_end(key)
+                    self.__stats['hits'] += 1
+                    return value
+                if loader is not None and age < self.ttl + self.stale_ttl:
+                    self.__data.move_to_end(key)
+                    self.__stats['stale_hits'] += 1
+                    self.__refresh(key, loader)
+                    return value
+            self.__stats['misses'] += 1
+
+        if loader is None:
+            return default
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        with self.__lock:
+            self.__data[key] = (value, time.monotonic())
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.max_size:
+                self.__data.popitem(last=False)
+                self.__stats['evictions'] += 1
+
+    def invalidate(self, key=None):
+        """
+        Eliminar una llave del cache, o todas si key es None
+        """
+        with self.__lock:
+            if key is None:
+                self.__data.clear()
+            else:
+                self.__data.pop(key, None)
+            self.__stats['invalidations'] += 1
+
+    def stats(self):
+        """
+        Contadores del cache
+        :return: dict con hits, stale_hits, misses, refreshes, evictions,
+            invalidations y size
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['size'] = len(self.__data)
+        return stats
+
+    def __refresh(self, key, loader):
+        # Un solo refresco en curso por llave
+        if key in self.__refreshing:
+            return
+        self.__refreshing.add(key)
+
+        def run():
+            try:
+                self.set(key, loader())
+                with self.__lock:
+                    self.__stats['refreshes'] += 1
+            except Exception as e:
+                logging.error(f'Error refrescando {key} en cache: {e}')
+                with self.__lock:
+                    self.__stats['refresh_errors'] += 1
+            finally:
+                with self.__lock:
+                    self.__refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,122 @@
+import os
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Libreria de JSON: auto (orjson, ujson o json segun esten instaladas), orjson, ujson o json
+JSON_CODEC = os.getenv('JSON_CODEC', 'auto')
+
+
+def __backend():
+    if JSON_CODEC == 'orjson' or (JSON_CODEC == 'auto' and orjson is not None):
+        if orjson is not None:
+            return 'orjson'
+    if JSON_CODEC in ('ujson', 'auto') and ujson is not None:
+        return 'ujson'
+    return 'json'
+
+
+BACKEND = __backend()
+
+
+def dumps_bytes(value, **kwargs) -> bytes:
+    """
+    Serializar un valor a JSON en bytes UTF-8
+    :param: kwargs
+        parametros de json.dumps, si se envian se usa la libreria estandar
+    """
+    if not kwargs:
+        if BACKEND == 'orjson':
+            try:
+                return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                # Tipos que orjson no soporta, p. ej. enteros de mas de 64 bits
+                pass
+        elif BACKEND == 'ujson':
+            try:
+                return ujson.dumps(value, ensure_ascii=False,
+                                   escape_forward_slashes=False).encode('utf-8')
+            except (TypeError, OverflowError):
+                pass
+    return json.dumps(value, **kwargs).encode('utf-8')
+
+
+def dumps(value, **kwargs) -> str:
+    """
+    Serializar un valor a JSON en string
+    :param: kwargs
+        parametros de json.dumps, si se envian se usa la libreria estandar
+    """
+    if kwargs or BACKEND == 'json':
+        return json.dumps(value, **kwargs)
+    return dumps_bytes(value).decode('utf-8')
+
+
+def loads(data, **kwargs):
+    """
+    Cargar un JSON de str o bytes
+    :param: kwargs
+        parametros de json.loads, si se envian se usa la libreria estandar
+    """
+    if not kwargs:
+        if BACKEND == 'orjson':
+            return orjson.loads(data)
+        if BACKEND == 'ujson':
+            try:
+                return ujson.loads(data)
+            except ValueError:
+                # El mensaje de error es el de la libreria estandar
+                pass
+    return json.loads(data, **kwargs)
+
+
+class Fragments:
+    """
+    Partes del evento serializadas durante una invocacion, cada objeto se
+    serializa una sola vez aunque varios decoradores lo necesiten
+    """
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id
+        self.__encoded = {}
+
+    @classmethod
+    def of(cls, context):
+        """
+        Obtener los fragmentos de la invocacion, se guardan en el context
+        :param: context
+            LambdaContext de la invocacion, puede ser None
+        """
+        request_id = getattr(context, 'aws_request_id', None)
+        fragments = getattr(context, 'json_fragments', None)
+        if fragments is None or fragments.request_id != request_id:
+            fragments = cls(request_id)
+            try:
+                context.json_fragments = fragments
+            except AttributeError:
+                pass
+        return fragments
+
+    def dumps_bytes(self, value) -> bytes:
+        return self.__entry(value)[1]
+
+    def dumps(self, value) -> str:
+        entry = self.__entry(value)
+        if entry[2] is None:
+            entry[2] = entry[1].decode('utf-8')
+        return entry[2]
+
+    def __entry(self, value):
+        # Se guarda el objeto para que su id no se reutilice en la invocacion
+        entry = self.__encoded.get(id(value))
+        if entry is None or entry[0] is not value:
+            entry = self.__encoded[id(value)] = [value, dumps_bytes(value), None]
+        return entry
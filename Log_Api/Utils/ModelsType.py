@@ -1,13 +1,43 @@
+import os
 import json
+import threading
+import unicodedata
 from sqlalchemy import Column, Integer, String, sql
 from ..Class.Database import declarative_base as BASE
+from .Cache import TTLCache
+
+# Tablas detalle cargadas en memoria
+catalog_cache = TTLCache(
+    ttl=float(os.getenv('CATALOG_CACHE_TTL', 300)),
+    max_size=int(os.getenv('CATALOG_CACHE_SIZE', 64))
+)
 
 class Model:
     """
     Clase para generar los modelos de la base de datos de tipo detalle
     """
+    _models = {}
+    _lock = threading.Lock()
+
     @classmethod
     def create(cls, table_name):
+        """
+        Obtener el modelo de una tabla de tipo detalle, se crea una sola vez
+        por tabla
+        :param table_name: str
+            Nombre de la tabla
+        return: Modelo de la tabla
+        """
+        model = cls._models.get(table_name)
+        if model is None:
+            with cls._lock:
+                model = cls._models.get(table_name)
+                if model is None:
+                    model = cls._models[table_name] = cls.__build(table_name)
+        return model
+
+    @classmethod
+    def __build(cls, table_name):
         """
         Función para crear el modelo de cualquier tabla de tipo detalle
         :param table_name: str 
@@ -87,4 +117,90 @@ class Model:
                     "user": str(self.date_update)
                 }
                 return json.dumps(columns)
-        return Table
\ No newline at end of file
+        return Table
+
+
+class Catalog:
+    """
+    Tabla de tipo detalle cargada completa en memoria, con indices por nombre
+    y código normalizados (sin mayúsculas, tildes ni espacios repetidos).
+    Se recarga cada CATALOG_CACHE_TTL segundos.
+    """
+
+    def __init__(self, table_name, active_only: bool = True):
+        """
+        :param table_name: str
+            Nombre de la tabla
+        :param active_only: bool
+            Cargar solo los registros activos (STATUS = 1)
+        """
+        self.table_name = table_name
+        self.active_only = active_only
+        self.model = Model.create(table_name)
+
+    @staticmethod
+    def normalize(value) -> str:
+        """
+        Normalizar un nombre o código para compararlo
+        """
+        value = unicodedata.normalize('NFKD', str(value))
+        value = ''.join(char for char in value if not unicodedata.combining(char))
+        return ' '.join(value.casefold().split())
+
+    def get_id(self, name: str, session):
+        """
+        Obtiene el id del registro a partir del nombre, primero por nombre
+        exacto y si no existe por el primer nombre que lo contenga
+        :param name: str
+            Nombre del registro
+        :param session: Session
+            Sesión de la base de datos, solo se usa al cargar la tabla
+        :return: int
+            Id de la tabla
+        """
+        catalog = self.__load(session)
+        name = self.normalize(name)
+        id_table = catalog['names'].get(name)
+        if id_table is None:
+            id_table = next(
+                (id_row for row_name, id_row in catalog['rows'] if name in row_name), None)
+        return sql.null() if id_table is None else id_table
+
+    def get_id_code(self, code: str, session):
+        """
+        Obtiene el id del registro a partir del código
+        :param code: str
+            Código del registro
+        :param session: Session
+            Sesión de la base de datos, solo se usa al cargar la tabla
+        :return: int
+            Id de la tabla
+        """
+        id_table = self.__load(session)['codes'].get(self.normalize(code))
+        return sql.null() if id_table is None else id_table
+
+    def refresh(self):
+        """
+        Descartar la tabla en memoria, se carga de nuevo en la siguiente consulta
+        """
+        catalog_cache.invalidate((self.table_name, self.active_only))
+
+    def __load(self, session):
+        return catalog_cache.get(
+            (self.table_name, self.active_only), lambda: self.__query(session))
+
+    def __query(self, session):
+        model = self.model
+        query = session.query(model.id_table, model.name, model.code)
+        if self.active_only:
+            query = query.filter(model.status == 1)
+
+        catalog = {'names': {}, 'codes': {}, 'rows': []}
+        for row in query.order_by(model.id_table).all():
+            if row.name is not None:
+                name = self.normalize(row.name)
+                catalog['names'].setdefault(name, row.id_table)
+                catalog['rows'].append((name, row.id_table))
+            if row.code is not None:
+                catalog['codes'].setdefault(self.normalize(row.code), row.id_table)
+        return catalog
@@ -1,4 +1,6 @@
-import json
+from .Json import dumps
+
+
 class Response:
 
     @classmethod
@@ -12,7 +14,7 @@ class Response:
             "headers": {
                 'Content-Type': 'application/json'
             },
-            "body": json.dumps(data)
+            "body": dumps(data)
         }
 
     @classmethod
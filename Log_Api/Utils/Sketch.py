@@ -0,0 +1,81 @@
+import math
+import json
+
+
+class Sketch:
+    """
+    Sketch de cuantiles mergeable con error relativo acotado (tipo DDSketch).
+    Cada valor cae en un bucket logaritmico, dos sketches se combinan sumando
+    sus buckets, asi los percentiles por minuto se pueden agregar por hora.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        """
+        :param: relative_accuracy
+            error relativo maximo de los cuantiles
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.__log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        """
+        Agregar un valor (no negativo)
+        """
+        if value is None:
+            return
+        if value <= 0:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self.__log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+
+    def merge(self, other: 'Sketch'):
+        """
+        Combinar otro sketch con la misma precision
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Los sketches deben tener la misma precision')
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q: float):
+        """
+        Obtener el cuantil q (0 a 1), None si el sketch esta vacio
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'a': self.relative_accuracy,
+            'z': self.zero_count,
+            'b': {str(index): count for index, count in self.buckets.items()}
+        })
+
+    @classmethod
+    def from_json(cls, data: str) -> 'Sketch':
+        if not data:
+            return cls()
+        data = json.loads(data)
+        sketch = cls(data['a'])
+        sketch.zero_count = data['z']
+        sketch.buckets = {int(index): count for index, count in data['b'].items()}
+        sketch.count = sketch.zero_count + sum(sketch.buckets.values())
+        return sketch
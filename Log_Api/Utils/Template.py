@@ -1,7 +1,36 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from functools import lru_cache
+from botocore.exceptions import ClientError
+
 from ..Utils import Aws
+from .Cache import TTLCache
+
+# Carpeta local de templates, sobrevive entre invocaciones del contenedor
+TEMPLATE_CACHE_DIR = os.getenv('TEMPLATE_CACHE_DIR', '/tmp/templates')
+
+# Cache en memoria de templates, al vencer se revalida con el ETag
+template_cache = TTLCache(
+    ttl=float(os.getenv('TEMPLATE_CACHE_TTL', 300)),
+    max_size=int(os.getenv('TEMPLATE_CACHE_SIZE', 32))
+)
+
+
+@lru_cache(maxsize=128)
+def _compile(variables: frozenset):
+    """
+    Expresion que encuentra todas las variables en una sola pasada, las mas
+    largas primero para que una variable no corte a otra que la contiene
+    """
+    return re.compile('|'.join(
+        re.escape(variable) for variable in sorted(variables, key=len, reverse=True)))
+
 
 class Template:
-    
+
     def __init__(self, template_name, bucket_secret_name: str):
         __s3 = Aws(bucket_secret_name).get_secret()
         self.template_name = template_name
@@ -10,13 +39,40 @@ class Template:
         self.bucket_name = __s3['bucket_name']
 
     def get_local_template(self):
-        
+
         template_content = ''
         with open(self.template_path, 'r') as f:
             template_content = f.read()
 
         return template_content
 
+    def get_template(self):
+        """
+        Obtener el template de S3 en string, se mantiene en memoria y en
+        TEMPLATE_CACHE_DIR, y al vencer TEMPLATE_CACHE_TTL solo se descarga
+        de nuevo si cambio su ETag
+        :return: contenido del template, None si no se pudo obtener
+        """
+        key = (self.bucket_name, self.template_path_aws)
+        template_content = template_cache.get(key, self.__load)
+        if template_content is None:
+            # Los errores no se guardan en cache
+            template_cache.invalidate(key)
+        return template_content
+
+    def render(self, variables: dict) -> str:
+        """
+        Obtener el template reemplazando todas las variables en una pasada
+        :param: variables
+            dict de variable a reemplazar: valor
+        """
+        template_content = self.get_template()
+        if template_content is None or not variables:
+            return template_content
+        variables = {old: str(new) for old, new in variables.items()}
+        return _compile(frozenset(variables)).sub(
+            lambda match: variables[match.group(0)], template_content)
+
     def get_with_replace_var(self, old: str, new: str) -> str:
         """
         Obtener el template en string y reemplazar la variable
@@ -25,9 +81,42 @@ class Template:
         :param: new
             variable a reemplazar
         """
-        # template_content = self.get_template()
-        s3_object = Aws.get_object(self.bucket_name, self.template_path_aws)
-        if s3_object:
-            template_content = s3_object.decode('utf-8')
-            s3_object = template_content.replace(old, new)
-        return s3_object
+        return self.render({old: new})
+
+    def __load(self):
+        local_path = os.path.join(TEMPLATE_CACHE_DIR, hashlib.sha1(
+            f'{self.bucket_name}/{self.template_path_aws}'.encode('utf-8')).hexdigest())
+        local = self.__read_local(local_path)
+
+        params = {'Bucket': self.bucket_name, 'Key': self.template_path_aws}
+        if local is not None:
+            params['IfNoneMatch'] = local['etag']
+        try:
+            s3_object = Aws.get_client('s3').get_object(**params)
+        except ClientError as e:
+            if local is not None and e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                return local['content']
+            logging.error(e)
+            return None
+
+        content = s3_object['Body'].read().decode('utf-8')
+        self.__write_local(local_path, {'etag': s3_object.get('ETag'), 'content': content})
+        return content
+
+    @staticmethod
+    def __read_local(local_path):
+        try:
+            with open(local_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def __write_local(local_path, data):
+        try:
+            os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+            with open(f'{local_path}.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(f'{local_path}.tmp', local_path)
+        except OSError as e:
+            logging.error(f'Error guardando template en {local_path}: {e}')
@@ -1,4 +1,11 @@
+import importlib
 from .Response import Response
 from .Aws import Aws
-from .ModelsType import Model
 from .Template import Template
+
+
+def __getattr__(name):
+    # ModelsType loads SQLAlchemy and Log_Api.Class, imported on first use
+    if name in ('Model', 'Catalog'):
+        return getattr(importlib.import_module('.ModelsType', __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1 +1,9 @@
-from .Class.LogAPI import log_resquest_response
\ No newline at end of file
+import importlib
+
+
+def __getattr__(name):
+    # The log decorators load SQLAlchemy and the models, they are imported on
+    # first use so the light modules (Utils.Json, Utils.Cache) do not pay it
+    if name in ('log_resquest_response', 'async_log_resquest_response'):
+        return getattr(importlib.import_module('.Class.LogAPI', __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,19 +1,32 @@
+import os
+import time
 import logging
 import ast
-import boto3
-from json import load, loads, dumps
+import threading
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from json import load
 from functools import wraps, update_wrapper
 
+from Log_Api.Utils.Json import loads, dumps
+
 try:
     import asyncio
 except ImportError:
     pass
 
 try:
-    from jsonschema import ValidationError, validate
+    from jsonschema import ValidationError
+    from jsonschema.exceptions import best_match
+    from jsonschema.validators import validator_for
 except ImportError:
     jsonschema = None
 
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
 try:
     from urllib.parse import parse_qs
 except ImportError:
@@ -91,7 +104,10 @@ def async_handler(handler):
             context.loop = asyncio.get_event_loop()
         except RuntimeError:
             context.loop = asyncio.new_event_loop()
-            # asyncio.set_event_loop(context.loop)
+        if context.loop.is_closed():
+            context.loop = asyncio.new_event_loop()
+        # The loop is reused by the next invocations, with the async engines bound to it
+        asyncio.set_event_loop(context.loop)
         return context.loop.run_until_complete(handler(event, context))
     return wrapper
     # def async_handler(event, context):
@@ -114,17 +130,9 @@ def cors_headers(handler_or_origin=None, origin=None, credentials=False):
         def wrapper_wrapper(handler):
             @wraps(handler)
             def wrapper(event, context):
-                response = handler(event, context)
-                if response is None:
-                    response = {}
-                headers = response.setdefault('headers', {})
-                if origin is not None:
-                    headers['Access-Control-Allow-Origin'] = origin
-                else:
-                    headers['Access-Control-Allow-Origin'] = handler_or_origin
-                if credentials:
-                    headers['Access-Control-Allow-Credentials'] = True
-                return response
+                return _add_cors_headers(
+                    handler(event, context),
+                    origin if origin is not None else handler_or_origin, credentials)
             return wrapper
         return wrapper_wrapper
     elif handler_or_origin is None:
@@ -132,6 +140,15 @@ def cors_headers(handler_or_origin=None, origin=None, credentials=False):
     else:
         return cors_headers("*")(handler_or_origin)
 
+def _add_cors_headers(response, origin, credentials=False):
+    if response is None:
+        response = {}
+    headers = response.setdefault('headers', {})
+    headers['Access-Control-Allow-Origin'] = origin
+    if credentials:
+        headers['Access-Control-Allow-Credentials'] = True
+    return response
+
 def dump_json_body(handler=None, **kwargs):
     """
     Decorator to dump the body of the request as JSON. 
@@ -170,21 +187,7 @@ def json_http_response(handler=None, **kwargs):
             @wraps(handler)
             def wrapper(event, context):
                 try:
-                    response = handler(event, context)
-                    if isinstance(response, dict):
-                        status_code = response.pop("statusCode", 200)
-                        headers = response.pop("headers", None)
-                    else:
-                        headers = None
-                        status_code = 200
-                    
-                    http_response = {
-                        "statusCode": status_code,
-                        "body": dumps(response, **kwargs),
-                    }
-                    if headers:
-                        http_response["headers"] = headers
-                    return http_response
+                    return _http_response(handler(event, context), **kwargs)
                 except Exception as exception:
                     if hasattr(context, "serverless_sdk"):
                         context.serverless_sdk.capture_exception(exception)
@@ -194,6 +197,22 @@ def json_http_response(handler=None, **kwargs):
     else:
         return json_http_response()(handler)
 
+def _http_response(response, **kwargs):
+    if isinstance(response, dict):
+        status_code = response.pop("statusCode", 200)
+        headers = response.pop("headers", None)
+    else:
+        headers = None
+        status_code = 200
+
+    http_response = {
+        "statusCode": status_code,
+        "body": dumps(response, **kwargs),
+    }
+    if headers:
+        http_response["headers"] = headers
+    return http_response
+
 def loads_json_body(handler=None, **kwargs):
     """
     Decorator to load the body of the request as JSON.
@@ -205,21 +224,26 @@ def loads_json_body(handler=None, **kwargs):
         def wrapper_wrapper(handler):
             @wraps(handler)
             def wrapper(event, context):
-                if isinstance(event.get("body"), str):
-                    try:
-                        event["body"] = loads(event["body"], **kwargs)
-                    except Exception as exception:
-                        if hasattr(context, "serverless_sdk"):
-                            context.serverless_sdk.capture_exception(exception)
-                        return {"statusCode": 400, "body": "bad request"}
-                else:
-                    event["body"] = {}
+                result = _loads_body(event, context, **kwargs)
+                if result is not None:
+                    return result
                 return handler(event, context)
             return wrapper
         return wrapper_wrapper
     else:
         return loads_json_body()(handler)
 
+def _loads_body(event, context, **kwargs):
+    if isinstance(event.get("body"), str):
+        try:
+            event["body"] = loads(event["body"], **kwargs)
+        except Exception as exception:
+            if hasattr(context, "serverless_sdk"):
+                context.serverless_sdk.capture_exception(exception)
+            return {"statusCode": 400, "body": "bad request"}
+    else:
+        event["body"] = {}
+
 def load_json_queryStringParameters(handler):
     """
     Decorator to load the event queryStringParameters of the request as JSON.
@@ -261,46 +285,139 @@ def load_json_queryStringParameters(handler):
         return handler(event, context)
     return wrapper
 
-def json_schema_validator(request_schema=None, document=None, body=True, in_file=False):
+# Seconds between checks of the schema files modification time
+SCHEMA_CHECK_INTERVAL = float(os.getenv('JSON_SCHEMA_CHECK_INTERVAL', 1))
+# Validation backend: jsonschema or fastjsonschema
+SCHEMA_BACKEND = os.getenv('JSON_SCHEMA_BACKEND', 'jsonschema')
+
+
+class SchemaValidator(object):
+    """
+    Validator of a schema document, the schema is checked and its validator
+    built once. With the fastjsonschema backend valid data only runs the
+    generated code, invalid data is validated again with jsonschema so the
+    error is the same for both backends.
+    """
+    def __init__(self, schema, backend=None):
+        backend = backend or SCHEMA_BACKEND
+        validator_class = validator_for(schema)
+        validator_class.check_schema(schema)
+        self.schema = schema
+        self.validator = validator_class(schema)
+        self.fast = None
+        if backend == 'fastjsonschema':
+            if fastjsonschema is None:
+                logger.warning("fastjsonschema is not installed, using jsonschema")
+            else:
+                self.fast = fastjsonschema.compile(schema)
+
+    def validate(self, data):
+        """
+        Raise the jsonschema ValidationError of the data, if any
+        """
+        if self.fast is not None:
+            try:
+                self.fast(data)
+                return
+            except fastjsonschema.JsonSchemaException:
+                pass
+        error = best_match(self.validator.iter_errors(data))
+        if error is not None:
+            raise error
+
+
+class SchemaFile(object):
+    """
+    Schema file loaded once and reloaded when its modification time changes,
+    with a validator per document
+    """
+    _files = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path, backend=None):
+        self.path = path
+        self.backend = backend
+        self.mtime = None
+        self.checked_at = 0
+        self.validators = {}
+
+    @classmethod
+    def get(cls, path, backend=None):
+        key = (path, backend)
+        schema_file = cls._files.get(key)
+        if schema_file is None:
+            with cls._lock:
+                schema_file = cls._files.setdefault(key, cls(path, backend))
+        return schema_file
+
+    def validator(self, document=None):
+        """
+        Validator of a document of the file, or of the whole file if
+        document is None
+        """
+        now = time.monotonic()
+        if now - self.checked_at >= SCHEMA_CHECK_INTERVAL:
+            mtime = os.stat(self.path).st_mtime
+            if mtime != self.mtime:
+                with self._lock:
+                    if mtime != self.mtime:
+                        with open(self.path) as lfile:
+                            self.data = load(lfile)
+                        self.validators = {}
+                        self.mtime = mtime
+            self.checked_at = now
+
+        validator = self.validators.get(document)
+        if validator is None:
+            schema = self.data if document is None else self.data[document]
+            validator = self.validators[document] = SchemaValidator(schema, self.backend)
+        return validator
+
+
+def json_schema_validator(request_schema=None, document=None, body=True, in_file=False, backend=None):
     """
     Decorator to validate the request for a API Gateway event.
-    Validate the request against the schema passed as `request_schema` parameter
+    Validate the request against the schema passed as `request_schema` parameter.
+    The schema file is loaded once and its validator built when the handler
+    is decorated, the file is reloaded if it changes.
+    `backend` can be jsonschema or fastjsonschema, JSON_SCHEMA_BACKEND by default
     """
     def wrapper_wrapper(handler):
+        if document is None:
+            document_name = handler.__name__
+        else:
+            document_name = document
+        if in_file:
+            document_name = None
+
+        schema_file = None
+        if request_schema is not None:
+            schema_file = SchemaFile.get(request_schema, backend)
+            # Invalid schemas fail on import instead of on the first request
+            schema_file.validator(document_name)
+
         @wraps(handler)
         def wrapper(event, context):
-            def validate_request_schema(request_data):
-                if request_schema is not None:
-                    try:
-                        with open(request_schema) as lfile:
-                            schema_data = load(lfile)
-                            if document is None:
-                                document_name = handler.__name__
-                            else:
-                                document_name = document
-                            if in_file == False:
-                                schema_data = schema_data[document_name]
-                            validate(request_data, schema_data)
-                    except ValidationError as ex:
-                        error_path = ".".join(str(path) for path in ex.path)
-                        error_message = f"Validation error at field '{error_path}': {ex.message}"
-                        logging.error(error_message)
-                        return {
-                            "statusCode": 400,
-                            "body": error_message
-                        }
-            # if 'jsonschema' not in globals():
-            #     logger.error("jsonschema is not installed")
-            #     raise Exception("jsonschema is not installed")
-            
-            if body:
-                result = validate_request_schema(event["body"])
+            if body and schema_file is not None:
+                result = _validate_request_schema(schema_file, document_name, event["body"])
                 if result is not None:
                     return result
             return handler(event, context)
         return wrapper
     return wrapper_wrapper
 
+def _validate_request_schema(schema_file, document_name, request_data):
+    try:
+        schema_file.validator(document_name).validate(request_data)
+    except ValidationError as ex:
+        error_path = ".".join(str(path) for path in ex.path)
+        error_message = f"Validation error at field '{error_path}': {ex.message}"
+        logging.error(error_message)
+        return {
+            "statusCode": 400,
+            "body": error_message
+        }
+
 def load_urlencoded_body(handler):
     """
     Decorator to load the body of the request as urlencoded, 
@@ -319,40 +436,209 @@ def load_urlencoded_body(handler):
     return wrapper
 
 
-def no_retry_on_failure(handler):
+def no_retry_on_failure(handler=None, store=None, key=None, cache_response=False):
     """
-    Decorator to disable retry on failure
+    Decorator to disable retry on failure.
+    The request IDs are claimed in an idempotency store, by default a
+    MemoryIdempotencyStore of the container bounded by IDEMPOTENCY_TTL and
+    IDEMPOTENCY_MAX_KEYS; DatabaseIdempotencyStore and
+    DynamoDBIdempotencyStore also catch retries that land on other
+    containers. `key` is a function of (event, context) that returns the
+    idempotency key, the aws_request_id by default. With
+    `cache_response=True` a retry of a completed request gets its original
+    response instead of {"statusCode": 200}.
     """
-    seen_request_ids = set()
-    
+    if handler is None:
+        def wrapper_wrapper(handler):
+            return no_retry_on_failure(handler, store=store, key=key, cache_response=cache_response)
+        return wrapper_wrapper
+
+    if store is None:
+        # Imported here, Log_Api.Class loads SQLAlchemy and the models
+        from Log_Api.Class.Idempotency import MemoryIdempotencyStore
+        store = MemoryIdempotencyStore()
+
     @wraps(handler)
     def wrapper(event, context):
-        if context.aws_request_id in seen_request_ids:
+        request_id = key(event, context) if key is not None else context.aws_request_id
+        idempotency_key = f"{handler.__name__}:{request_id}"
+        try:
+            record = store.claim(idempotency_key)
+        except Exception as exception:
+            # The request runs if the store is not available
+            logger.error("Error claiming idempotency key %s: %s", idempotency_key, exception)
+            return handler(event, context)
+
+        if record is not None:
             logger.critical(
-                "Request ID has already been seen, this is a retry. ", context.aws_request_id
+                "Request ID has already been seen, this is a retry. %s", request_id
             )
+            if cache_response and record.get("response") is not None:
+                return record["response"]
             return {"statusCode": 200}
-        seen_request_ids.add(context.aws_request_id)
-        return handler(event, context)
+
+        response = handler(event, context)
+        try:
+            store.complete(idempotency_key, response if cache_response else None)
+        except Exception as exception:
+            logger.error("Error saving idempotency key %s: %s", idempotency_key, exception)
+        return response
     return wrapper
 
 
-def ssm_parameter_store(*parameters):
+# Parameters and secrets of the decorators are resolved once per container,
+# in TTLCaches created on first use (see _cache)
+CACHE_SETTINGS = {
+    "parameters": {
+        "ttl": float(os.getenv('PARAMETER_CACHE_TTL', 300)),
+        "max_size": int(os.getenv('PARAMETER_CACHE_SIZE', 256))
+    },
+    # Separate from the Aws secret cache: binary secrets are kept as they are
+    "secrets": {
+        "ttl": float(os.getenv('SECRETS_DECORATOR_CACHE_TTL', 300)),
+        "max_size": int(os.getenv('SECRETS_DECORATOR_CACHE_SIZE', 64))
+    }
+}
+_caches = {}
+_caches_lock = threading.Lock()
+# Max concurrent SSM and Secrets Manager calls on a cache miss
+FETCH_MAX_WORKERS = int(os.getenv('PARAMETER_FETCH_MAX_WORKERS', 4))
+# Names per get_parameters and batch_get_secret_value call (API limits)
+SSM_CHUNK_SIZE = 10
+SECRETS_CHUNK_SIZE = 20
+
+_MISSING = object()
+# Cached for the names SSM reports as invalid, so they are not requested again
+_INVALID = object()
+
+
+def _cache(name):
+    """
+    Cache of the parameters or the secrets, the Log_Api modules are only
+    imported by the decorators that use them
+    """
+    cache = _caches.get(name)
+    if cache is None:
+        from Log_Api.Utils.Cache import TTLCache
+        with _caches_lock:
+            cache = _caches.get(name)
+            if cache is None:
+                cache = _caches[name] = TTLCache(**CACHE_SETTINGS[name])
+    return cache
+
+
+def _chunks(names, size):
+    return [names[index:index + size] for index in range(0, len(names), size)]
+
+
+def _map_concurrent(func, items):
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(len(items), FETCH_MAX_WORKERS)) as executor:
+        return list(executor.map(func, items))
+
+
+def _resolve(cache, keys, fetch):
     """
-    Decorator to load parameters from AWS SSM Parameter Store
+    Values of the keys from the cache, the missing ones are fetched together
+    with fetch(missing_keys) -> dict
+    """
+    values, missing = {}, []
+    for key in keys:
+        value = cache.get(key, default=_MISSING)
+        if value is _MISSING:
+            missing.append(key)
+        else:
+            values[key] = value
+    if missing:
+        for key, value in fetch(missing).items():
+            cache.set(key, value)
+            values[key] = value
+    return values
+
+
+def _fetch_parameters(names):
+    from Log_Api.Utils.Aws import Aws
+    ssm = Aws.get_client("ssm")
+
+    def get_parameters(chunk):
+        response = ssm.get_parameters(Names=chunk, WithDecryption=True)
+        if response.get("InvalidParameters"):
+            logger.warning("Invalid SSM parameters: %s", response["InvalidParameters"])
+        return response["Parameters"]
+
+    return {
+        parameter["Name"]: parameter["Value"]
+        for chunk in _map_concurrent(get_parameters, _chunks(list(names), SSM_CHUNK_SIZE))
+        for parameter in chunk
+    }
+
+
+def _fetch_parameters_by_path(keys):
+    from Log_Api.Utils.Aws import Aws
+    ssm = Aws.get_client("ssm")
+    values = {}
+    for key in keys:
+        _, path, recursive = key
+        parameters = {}
+        for page in ssm.get_paginator("get_parameters_by_path").paginate(
+                Path=path, Recursive=recursive, WithDecryption=True):
+            for parameter in page["Parameters"]:
+                parameters[parameter["Name"]] = parameter["Value"]
+        values[key] = parameters
+    return values
+
+
+def resolve_parameters(names=(), path=None, recursive=True):
+    """
+    Values of SSM parameters by name and under a path, cached for
+    PARAMETER_CACHE_TTL seconds. Missing names are fetched with
+    get_parameters in chunks of 10.
+    """
+    values = {}
+    if path is not None:
+        path_keys = [("path", path, recursive)]
+        for parameters in _resolve(_cache("parameters"), path_keys, _fetch_parameters_by_path).values():
+            values.update(parameters)
+    if names:
+        keys = [("name", name) for name in names]
+        def fetch(missing):
+            fetched = _fetch_parameters([key[1] for key in missing])
+            return {key: fetched.get(key[1], _INVALID) for key in missing}
+
+        values.update({key[1]: value for key, value in
+                       _resolve(_cache("parameters"), keys, fetch).items() if value is not _INVALID})
+    return values
+
+
+def ssm_parameter_store(*parameters, path=None, recursive=True, prefetch=False):
+    """
+    Decorator to load parameters from AWS SSM Parameter Store.
+    The parameters are resolved once per container and cached for
+    PARAMETER_CACHE_TTL seconds. `path` also loads every parameter under a
+    path. With `prefetch=True` they are loaded when the handler is decorated,
+    so the first request does not wait for SSM.
     """
     
     if len(parameters) == 1 and not isinstance(parameters[0], basestring):
         parameters = parameters[0]
+    parameters = list(parameters)
+
+    def load_parameters():
+        return resolve_parameters(parameters, path, recursive)
+
+    if prefetch:
+        try:
+            load_parameters()
+        except Exception as exception:
+            logger.warning("Error prefetching SSM parameters: %s", exception)
 
     def wrapper_wrapper(handler):
         @wraps(handler)
         def wrapper(event, context):
-            ssm = boto3.client("ssm")
             if not hasattr(context, "parameters"):
                 context.parameters = {}
-            for parameter in ssm.get_parameters(Names=parameters, WithDecryption=True)["Parameters"]:
-                context.parameters[parameter["Name"]] = parameter["Value"]
+            context.parameters.update(load_parameters())
 
             return handler(event, context)
 
@@ -361,25 +647,93 @@ def ssm_parameter_store(*parameters):
     return wrapper_wrapper
 
 
-def secrets_manager(*secret_names):
+def _secret_value(secret_value):
+    if "SecretString" in secret_value:
+        return loads(secret_value["SecretString"])
+    return secret_value["SecretBinary"]
+
+
+def _fetch_secrets(secret_names):
+    from Log_Api.Utils.Aws import Aws
+    client = Aws.get_client("secretsmanager")
+    values = {}
+    if len(secret_names) > 1 and hasattr(client, "batch_get_secret_value"):
+        try:
+            for chunk in _chunks(list(secret_names), SECRETS_CHUNK_SIZE):
+                params = {"SecretIdList": chunk}
+                while True:
+                    response = client.batch_get_secret_value(**params)
+                    for secret_value in response.get("SecretValues", []):
+                        for secret_name in chunk:
+                            if secret_name in (secret_value.get("Name"), secret_value.get("ARN")):
+                                values[secret_name] = _secret_value(secret_value)
+                    if not response.get("NextToken"):
+                        break
+                    params["NextToken"] = response["NextToken"]
+        except ClientError as exception:
+            # Without secretsmanager:BatchGetSecretValue each secret is read alone
+            logger.warning("batch_get_secret_value failed, reading secrets one by one: %s", exception)
+
+    missing = [secret_name for secret_name in secret_names if secret_name not in values]
+    for secret_name, secret_value in zip(missing, _map_concurrent(
+            lambda secret_name: client.get_secret_value(SecretId=secret_name), missing)):
+        values[secret_name] = _secret_value(secret_value)
+    return values
+
+
+def resolve_secrets(secret_names):
+    """
+    Values of Secrets Manager secrets, cached for SECRETS_DECORATOR_CACHE_TTL seconds.
+    Missing secrets are read with batch_get_secret_value, or concurrently
+    with get_secret_value
+    """
+    return _resolve(_cache("secrets"), list(secret_names), _fetch_secrets)
+
+
+def invalidate_secrets(*secret_names):
     """
-    Decorator to load secrets from AWS Secrets Manager
+    Remove secrets of `secrets_manager` from the cache, all of them if no
+    name is given, e.g. after a rotation
     """
+    if not secret_names:
+        _cache("secrets").invalidate()
+    for secret_name in secret_names:
+        _cache("secrets").invalidate(secret_name)
+
+
+def invalidate_parameters():
+    """
+    Remove the parameters of `ssm_parameter_store` from the cache
+    """
+    _cache("parameters").invalidate()
+
+
+def resolved_cache_stats():
+    """
+    Hits, misses and size of the parameter and secret caches of the decorators
+    """
+    return {"parameters": _cache("parameters").stats(), "secrets": _cache("secrets").stats()}
+
+
+def secrets_manager(*secret_names, prefetch=False):
+    """
+    Decorator to load secrets from AWS Secrets Manager.
+    The secrets are resolved once per container and cached for
+    SECRETS_DECORATOR_CACHE_TTL seconds. With `prefetch=True` they are loaded when the
+    handler is decorated.
+    """
+    if prefetch:
+        try:
+            resolve_secrets(secret_names)
+        except Exception as exception:
+            logger.warning("Error prefetching secrets: %s", exception)
+
     def wrapper_wrapper(handler):
         @wraps(handler)
         def wrapper(event, context):
             if not hasattr(context, "secrets"):
                 context.secrets = {}
-            for secret_name in secret_names:
-                secret_value = boto3.client(
-                    service_name="secretsmanager"
-                ).get_secret_value(SecretId=secret_name)
-                if "SecretString" in secret_value:
-                    context.secrets[secret_name] = loads(
-                        secret_value["SecretString"]
-                    )
-                else:
-                    context.secrets[secret_name] = secret_value["SecretBinary"]
+            context.secrets.update(resolve_secrets(secret_names))
 
             return handler(event, context)
 
@@ -393,3 +747,238 @@ def secret_manager(secret_name):
     Get a single secret from AWS Secrets Manager
     """
     return secrets_manager(secret_name)
+
+
+# Record the time of each pipeline stage by default
+PIPELINE_PROFILE = os.getenv('PIPELINE_PROFILE', 'false').lower() == 'true'
+
+
+class Pipeline(object):
+    """
+    Ordered before, after and on_error stages compiled once, when the handler
+    is decorated, into a flat list of calls instead of nested wrappers:
+
+    - before stages are called with (event, context); returning a response
+      skips the next before stages and the handler.
+    - after stages are called with (response, event, context) and return
+      the response.
+    - on_error stages are called with (exception, event, context); the first
+      one returning a response handles the exception, if none does it is
+      raised. Responses of errors raised before the after stages also go
+      through the after stages.
+
+    Stages and the handler can be sync or coroutine functions, the handler
+    is a coroutine function if any of them is. With `profile=True` (or
+    PIPELINE_PROFILE=true) the time of each stage is kept in `stats()` and
+    the times of the invocation in `context.pipeline_timings`.
+
+    pipeline = Pipeline(
+        before=[loads_json_body_stage(), json_schema_stage('schema.json', 'createUser')],
+        after=[json_http_response_stage(), cors_stage()],
+        on_error=[http_error_stage]
+    )
+
+    @pipeline
+    def createUser(event, context):
+        ...
+    """
+    def __init__(self, before=(), after=(), on_error=(), profile=None):
+        self.before = list(before)
+        self.after = list(after)
+        self.on_error = list(on_error)
+        self.profile = PIPELINE_PROFILE if profile is None else profile
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    def __call__(self, handler):
+        names = set()
+        before = [self.__step('before', stage, names) for stage in self.before]
+        call = self.__step('handler', handler, names)
+        after = [self.__step('after', stage, names) for stage in self.after]
+        on_error = [self.__step('on_error', stage, names) for stage in self.on_error]
+
+        steps = before + [call] + after + on_error
+        if any(is_async for _, _, is_async in steps):
+            wrapper = self.__compile_async(before, call, after, on_error)
+        else:
+            wrapper = self.__compile(before, call, after, on_error)
+        wrapper = wraps(handler)(wrapper)
+        wrapper.pipeline = self
+        return wrapper
+
+    def stats(self):
+        """
+        Calls, total and max milliseconds of each stage, when profiling
+        """
+        with self.__lock:
+            return {name: dict(stats) for name, stats in self.__stats.items()}
+
+    def __step(self, phase, stage, names):
+        name = f"{phase}:{getattr(stage, '__name__', type(stage).__name__)}"
+        unique_name, count = name, 1
+        while unique_name in names:
+            count += 1
+            unique_name = f'{name}#{count}'
+        names.add(unique_name)
+        is_async = asyncio.iscoroutinefunction(stage) or asyncio.iscoroutinefunction(
+            getattr(stage, '__call__', None))
+        return unique_name, stage, is_async
+
+    def __record(self, context, timings):
+        with self.__lock:
+            for name, elapsed_ms in timings.items():
+                stats = self.__stats.setdefault(name, {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+                stats['calls'] += 1
+                stats['total_ms'] += elapsed_ms
+                stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        try:
+            context.pipeline_timings = timings
+        except AttributeError:
+            pass
+
+    def __compile(self, before, call, after, on_error):
+        profile = self.profile
+        record = self.__record
+
+        def run(name, stage, timings, *args):
+            if not profile:
+                return stage(*args)
+            start = time.perf_counter_ns()
+            try:
+                return stage(*args)
+            finally:
+                timings[name] = (time.perf_counter_ns() - start) / 1e6
+
+        def handle(exception, event, context, timings):
+            for name, stage, _ in on_error:
+                response = run(name, stage, timings, exception, event, context)
+                if response is not None:
+                    return response
+            raise exception
+
+        def wrapper(event, context):
+            timings = {}
+            try:
+                try:
+                    response = None
+                    for name, stage, _ in before:
+                        response = run(name, stage, timings, event, context)
+                        if response is not None:
+                            break
+                    else:
+                        response = run(call[0], call[1], timings, event, context)
+                except Exception as exception:
+                    response = handle(exception, event, context, timings)
+                try:
+                    for name, stage, _ in after:
+                        response = run(name, stage, timings, response, event, context)
+                except Exception as exception:
+                    response = handle(exception, event, context, timings)
+                return response
+            finally:
+                if profile:
+                    record(context, timings)
+        return wrapper
+
+    def __compile_async(self, before, call, after, on_error):
+        profile = self.profile
+        record = self.__record
+
+        async def run(name, stage, is_async, timings, *args):
+            start = time.perf_counter_ns() if profile else 0
+            try:
+                if is_async:
+                    return await stage(*args)
+                return stage(*args)
+            finally:
+                if profile:
+                    timings[name] = (time.perf_counter_ns() - start) / 1e6
+
+        async def handle(exception, event, context, timings):
+            for name, stage, is_async in on_error:
+                response = await run(name, stage, is_async, timings, exception, event, context)
+                if response is not None:
+                    return response
+            raise exception
+
+        async def wrapper(event, context):
+            timings = {}
+            try:
+                try:
+                    response = None
+                    for name, stage, is_async in before:
+                        response = await run(name, stage, is_async, timings, event, context)
+                        if response is not None:
+                            break
+                    else:
+                        response = await run(*call, timings, event, context)
+                except Exception as exception:
+                    response = await handle(exception, event, context, timings)
+                try:
+                    for name, stage, is_async in after:
+                        response = await run(name, stage, is_async, timings, response, event, context)
+                except Exception as exception:
+                    response = await handle(exception, event, context, timings)
+                return response
+            finally:
+                if profile:
+                    record(context, timings)
+        return wrapper
+
+
+def cors_stage(origin="*", credentials=False):
+    """
+    After stage with the headers of `cors_headers`
+    """
+    def cors_headers(response, event, context):
+        return _add_cors_headers(response, origin, credentials)
+    return cors_headers
+
+
+def loads_json_body_stage(**kwargs):
+    """
+    Before stage with the behaviour of `loads_json_body`
+    """
+    def loads_json_body(event, context):
+        return _loads_body(event, context, **kwargs)
+    return loads_json_body
+
+
+def json_schema_stage(request_schema, document=None, in_file=False, backend=None):
+    """
+    Before stage with the validation of `json_schema_validator`, `document`
+    is required unless the whole file is the schema
+    """
+    if document is None and not in_file:
+        raise TypeError('json_schema_stage() requires document or in_file=True')
+    document_name = None if in_file else document
+    schema_file = SchemaFile.get(request_schema, backend)
+    schema_file.validator(document_name)
+
+    def json_schema_validator(event, context):
+        return _validate_request_schema(schema_file, document_name, event["body"])
+    return json_schema_validator
+
+
+def json_http_response_stage(**kwargs):
+    """
+    After stage with the serialization of `json_http_response`. Responses
+    that already have a statusCode and a string body, like the ones of the
+    before and on_error stages, are returned as they are
+    """
+    def json_http_response(response, event, context):
+        if (isinstance(response, dict) and "statusCode" in response
+                and isinstance(response.get("body"), str)):
+            return response
+        return _http_response(response, **kwargs)
+    return json_http_response
+
+
+def http_error_stage(exception, event, context):
+    """
+    On error stage with the 500 response of `json_http_response`
+    """
+    if hasattr(context, "serverless_sdk"):
+        context.serverless_sdk.capture_exception(exception)
+    logger.exception(exception)
+    return {"statusCode": 500, "body": str(exception)}
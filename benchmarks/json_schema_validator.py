@@ -0,0 +1,76 @@
+"""
+Per request cost of json_schema_validator: the schema file loaded and
+validated on every request against the cached validators.
+
+    python benchmarks/json_schema_validator.py [requests]
+"""
+import os
+import sys
+import json
+import timeit
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jsonschema import validate
+from aws_handler_decorators import json_schema_validator, fastjsonschema
+
+SCHEMA = {
+    "createUser": {
+        "type": "object",
+        "required": ["name", "email", "age", "roles"],
+        "properties": {
+            "name": {"type": "string", "minLength": 1, "maxLength": 100},
+            "email": {"type": "string", "pattern": "^[^@]+@[^@]+$"},
+            "age": {"type": "integer", "minimum": 0},
+            "roles": {"type": "array", "items": {"type": "string"}, "maxItems": 10},
+            "address": {
+                "type": "object",
+                "properties": {
+                    "city": {"type": "string"},
+                    "zip": {"type": "string"}
+                }
+            }
+        }
+    }
+}
+BODY = {"name": "Ana", "email": "ana@example.com", "age": 30,
+        "roles": ["admin", "user"], "address": {"city": "Bogota", "zip": "110111"}}
+
+
+def legacy(schema_path):
+    # Previous behaviour: the file is opened and the validator built per request
+    def handler(event, context):
+        with open(schema_path) as lfile:
+            validate(event["body"], json.load(lfile)["createUser"])
+        return {"statusCode": 200}
+    return handler
+
+
+def createUser(event, context):
+    return {"statusCode": 200}
+
+
+def main(requests=5000):
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as schema_file:
+        json.dump(SCHEMA, schema_file)
+    handlers = {
+        'legacy': legacy(schema_file.name),
+        'jsonschema': json_schema_validator(schema_file.name, backend='jsonschema')(createUser),
+    }
+    if fastjsonschema is not None:
+        handlers['fastjsonschema'] = json_schema_validator(
+            schema_file.name, backend='fastjsonschema')(createUser)
+
+    event = {"body": BODY}
+    try:
+        for name, handler in handlers.items():
+            assert handler(event, None) == {"statusCode": 200}
+            seconds = min(timeit.repeat(lambda: handler(event, None), number=requests, repeat=3))
+            print(f'{name:<15} {seconds / requests * 1e6:10.1f} us/request')
+    finally:
+        os.remove(schema_file.name)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -1,8 +1,12 @@
+import re
 from setuptools import setup
-import aws_handler_decorators
+
+# The version is read from the file, importing the module needs the dependencies
+with open('aws_handler_decorators.py') as f:
+    version = re.search(r"^__version__ = '([^']+)'", f.read(), re.M).group(1)
 
 setup(name='Log_Api',
-      version=aws_handler_decorators.__version__,
+      version=version,
       description='Paquete para el manejo de logs de apis aws lambda serverles con sqlalchemy',
       url='https://github.com/1kagro/serverless-sqlalchemy-logapi',
       author='Fabian Lozano',